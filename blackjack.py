@@ -1,12 +1,336 @@
-import random
 import unittest
+import numpy as np
+
+class RandomStream:
+	# Seeded source of uniform random numbers for card draws and the search. The
+	# numbers come from a NumPy Generator in blocks of block_size and are handed out
+	# one at a time, so a draw is a list index instead of a call into the random
+	# module, and two streams seeded alike hand out exactly the same numbers.
+	__slots__ = ('generator', 'buffer', 'pos', 'block_size')
+
+	def __init__(self, seed = None, block_size = 4096):
+		self.block_size = block_size
+		self.seed(seed)
+
+	# restart the stream from seed, an int or SeedSequence (None for fresh entropy)
+	def seed(self, seed = None):
+		self.generator = np.random.default_rng(seed)
+		self.buffer = self.generator.random(self.block_size).tolist()
+		self.pos = 0
+
+	# independent stream seeded from this one's seed, without drawing from it, so work
+	# done on the new stream doesn't change what this one hands out next
+	def spawn(self):
+		return RandomStream(self.generator.bit_generator.seed_seq.spawn(1)[0], self.block_size)
+
+	# uniform float in [0, 1)
+	def random(self):
+		pos = self.pos
+		if pos >= self.block_size:
+			# every block is block_size long, so a thread racing a refill can at worst
+			# reuse a number, never read past the end
+			self.buffer = self.generator.random(self.block_size).tolist()
+			pos = 0
+		self.pos = pos + 1
+		return self.buffer[pos]
+
+	# uniform int in [0, n)
+	def randrange(self, n):
+		return int(self.random() * n)
+
+	def choice(self, seq):
+		return seq[self.randrange(len(seq))]
+
+	# index into weights, picked with probability proportional to its weight
+	def pick(self, weights):
+		u = self.random() * sum(weights)
+		last = 0
+		for i, w in enumerate(weights):
+			if u < w:
+				return i
+			u -= w
+			if w > 0:
+				last = i
+		# rounding left u just past the total
+		return last
+
+# stream behind Shoe draws and the search, seed it for reproducible runs
+default_stream = RandomStream()
+
+class Shoe(list):
+	# Card counts indexed by value, same layout as Game.deck, plus a Fenwick tree of
+	# cumulative counts. A weighted draw walks the tree in O(log n) instead of
+	# rebuilding lists of eligible values and weights for every card.
+	# Counts must be changed by index (shoe[i] = n, shoe[i] += 1) so the tree stays in sync.
+	# Cards are drawn from stream, which copies share; searches give their copy its own.
+	__slots__ = ('tree', 'total', 'stream')
+
+	def __init__(self, counts = None, stream = None):
+		if counts is None:
+			counts = [4,4,4,4,4,4,4,4,4,16]
+		if stream is None:
+			stream = default_stream
+		list.__init__(self, counts)
+		self.stream = stream
+		self.rebuild()
+
+	def rebuild(self):
+		self.tree = [0] * (len(self) + 1)
+		self.total = 0
+		for i in range(len(self)):
+			self.add(i, list.__getitem__(self, i))
+
+	# add delta to the count of value i in the tree only
+	def add(self, i, delta):
+		self.total += delta
+		i += 1
+		while i < len(self.tree):
+			self.tree[i] += delta
+			i += i & -i
+
+	def __setitem__(self, i, count):
+		if isinstance(i, slice):
+			list.__setitem__(self, i, count)
+			self.rebuild()
+		else:
+			self.add(i % len(self), count - list.__getitem__(self, i))
+			list.__setitem__(self, i, count)
+
+	def copy(self):
+		shoe = Shoe.__new__(Shoe)
+		list.extend(shoe, self)
+		shoe.tree = self.tree[:]
+		shoe.total = self.total
+		shoe.stream = self.stream
+		return shoe
+
+	def __copy__(self):
+		return self.copy()
+
+	def __deepcopy__(self, memo):
+		return self.copy()
+
+	# value of the card at position u (0 <= u < total) when the shoe is laid out in value order
+	def select(self, u):
+		tree = self.tree
+		pos = 0
+		step = 1 << (len(tree) - 1).bit_length() - 1
+		while step:
+			nxt = pos + step
+			if nxt < len(tree) and tree[nxt] <= u:
+				pos = nxt
+				u -= tree[nxt]
+			step >>= 1
+		return pos
+
+	# remove one random card, weighted by the number of each value left
+	def draw(self):
+		if self.total <= 0:
+			raise ValueError('Deck is empty: Cannot draw a card.')
+		value = self.select(self.stream.randrange(self.total))
+		self.add(value, -1)
+		list.__setitem__(self, value, list.__getitem__(self, value) - 1)
+		return value
+
+	def draw_many(self, k):
+		if k > self.total:
+			raise ValueError('Deck has {} cards: Cannot draw {}.'.format(self.total, k))
+		draw = self.draw
+		return [draw() for i in range(k)]
+
+class Hand(list):
+	# Cards in a hand (card values as in Game.deck indexes) with a running hard total,
+	# counting every ace as 1, and ace count. Both are updated as cards are added, so
+	# scoring is O(1) instead of a rescan of the list. Any other change recounts them.
+	__slots__ = ('hard', 'aces')
+
+	def __init__(self, cards = ()):
+		list.__init__(self, cards)
+		self.rebuild()
+
+	def rebuild(self):
+		self.hard = list.__len__(self) + sum(self)
+		self.aces = list.count(self, 0)
+
+	def append(self, card):
+		list.append(self, card)
+		self.hard += card + 1
+		if card == 0:
+			self.aces += 1
+
+	def extend(self, cards):
+		for card in cards:
+			self.append(card)
+
+	def __iadd__(self, cards):
+		self.extend(cards)
+		return self
+
+	def __setitem__(self, i, card):
+		list.__setitem__(self, i, card)
+		self.rebuild()
+
+	def __delitem__(self, i):
+		list.__delitem__(self, i)
+		self.rebuild()
+
+	def insert(self, i, card):
+		list.insert(self, i, card)
+		self.rebuild()
+
+	def pop(self, i = -1):
+		card = list.pop(self, i)
+		self.rebuild()
+		return card
+
+	def remove(self, card):
+		list.remove(self, card)
+		self.rebuild()
+
+	def clear(self):
+		list.clear(self)
+		self.rebuild()
+
+	def copy(self):
+		hand = Hand.__new__(Hand)
+		list.extend(hand, self)
+		hand.hard = self.hard
+		hand.aces = self.aces
+		return hand
+
+	def __copy__(self):
+		return self.copy()
+
+	def __deepcopy__(self, memo):
+		return self.copy()
+
+	# we will never score more than one ace as 11, and only if that doesn't bust
+	@property
+	def is_soft(self):
+		return self.aces > 0 and self.hard <= 11
+
+	@property
+	def value(self):
+		if self.aces and self.hard <= 11:
+			return self.hard + 10
+		return self.hard
+
+	@property
+	def is_bust(self):
+		return self.hard > 21
+
+	@property
+	def is_blackjack(self):
+		return list.__len__(self) == 2 and self.value == 21
+
+# Event sinks
+# Game flow reports what happens as named events instead of printing, and asks
+# its sink for any input it needs. Events and their extra info:
+#   "deal"           - opening cards are dealt
+#   "hands"          - current hands should be shown
+#   "searching"      - the AI has started looking for a reccomendation
+#   "recommendation" - action: reccomended action code, value: its estimated value,
+#                      text: message for the player; the paired engine also sends
+#                      advantage over the next best action and its standard error
+#   "search_stats"   - stats: blackjack_mcts.SearchStats for the search just run
+#   "action"         - action: action code the player took
+#   "dealer_hit"     - dealer takes a card
+#   "dealer_stay"    - dealer stays
+#   "invalid_turn"   - turn was not Player, Dealer or End, the hand is ended
+#   "end"            - hand is over and scored
+#   "result"         - outcome: "blackjack", "standoff", "dealer blackjack", "win", "lose" or "draw",
+#                      amount: change in winnings
+class NullSink:
+	# Discards every event. Automated runs use it to skip all output.
+	progress = False
+
+	def emit(self, event, game = None, **info):
+		pass
+
+	def ask_bet(self, game):
+		raise ValueError("A bet must be given when playing without a terminal.")
+
+	def ask_action(self, game, can_double_down):
+		raise ValueError("An action must be chosen automatically when playing without a terminal.")
+
+class CounterSink(NullSink):
+	# Counts events by name and totals the results in memory without formatting anything.
+	def __init__(self):
+		self.counts = {}
+		self.results = {}
+		self.amount = 0.0
+
+	def emit(self, event, game = None, **info):
+		self.counts[event] = self.counts.get(event, 0) + 1
+		if event == "result":
+			self.results[info["outcome"]] = self.results.get(info["outcome"], 0) + 1
+			self.amount += info["amount"]
+
+class TerminalSink(NullSink):
+	# Interactive play: prints each event and reads bets and actions from the keyboard.
+	progress = True
+
+	def emit(self, event, game = None, **info):
+		if event == "hands":
+			game.print_hands()
+		elif event == "searching":
+			print("Running simulations...")
+		elif event == "recommendation":
+			print(info["text"])
+		elif event == "dealer_hit":
+			print("~~~~~~~~ Dealer Hits ~~~~~~~~")
+		elif event == "dealer_stay":
+			print("~~~~~~~~ Dealer Stays ~~~~~~~~")
+		elif event == "invalid_turn":
+			print("Invalid Turn State: Game Ending")
+		elif event == "end":
+			print("\nEnd State Reached")
+			game.print_hands()
+			print("   Dealer Score: {}\n   Player Score: {}".format(game.score_d_hand(), game.score_p_hand()))
+		elif event == "result":
+			print(self.result_messages[info["outcome"]])
+
+	result_messages = {
+		"blackjack": "Blackjack! You win 1.5x your bet!",
+		"standoff": "Stand-off: Your bet has been returned.",
+		"dealer blackjack": "Dealer Blackjack. You Lose.",
+		"win": "You Win",
+		"lose": "You Lose",
+		"draw": "Draw",
+	}
+
+	def ask_bet(self, game):
+		print("Available Funds: ${0:.2f}\nEnter Bet Amount: ".format(game.budget + game.winnings))
+		bet = float(input())
+		while bet > game.budget + game.winnings:
+			print("You can not bet more than the amount of money you have.\nAvailable Funds: ${}\nEnter Bet Amount: ".format(game.budget + game.winnings))
+			bet = float(input())
+		return bet
+
+	# returns 1 (hit), 2 (stay) or 3 (double down)
+	def ask_action(self, game, can_double_down):
+		if can_double_down:
+			print("\n\nSelect an action:\n1) Hit\n2) Stay\n3) Double Down")
+			action = int(input())
+			while action < 1 or action > 3:
+				print("\n\nSelect an action:\n1) Hit\n2) Stay\n3) Double Down")
+				action = int(input())
+
+		else:
+			print("\n\nSelect an action:\n1) Hit\n2) Stay")
+			action = int(input())
+			while action < 1 or action > 2:
+				print("\n\nSelect an action:\n1) Hit\n2) Stay")
+				action = int(input())
+
+		return action
 
 class Game:
-	def __init__(self, deck = None, p_hand = None, d_hand = None, budget = None, winnings = None, d_stay = None, turn = None):
+	def __init__(self, deck = None, p_hand = None, d_hand = None, budget = None, winnings = None, d_stay = None, turn = None, sink = None):
 		if deck is None:
 			#The index represents the card value, the element represents the number of that card value in the deck
 			#Because the cards 10, J, Q, K all have a value of 10, they are aggregated together.
-			self.deck = [4,4,4,4,4,4,4,4,4,16]
+			self.deck = Shoe([4,4,4,4,4,4,4,4,4,16])
 		else:
 			self.deck = deck
 
@@ -40,6 +364,44 @@ class Game:
 		else:
 			self.turn = turn
 
+		# where game events go, see NullSink
+		if sink is None:
+			self.sink = TerminalSink()
+		else:
+			self.sink = sink
+
+	# the deck is always kept as a Shoe so draws can use its sampler
+	@property
+	def deck(self):
+		return self._deck
+
+	@deck.setter
+	def deck(self, deck):
+		if not isinstance(deck, Shoe):
+			deck = Shoe(deck)
+		self._deck = deck
+
+	# hands are always kept as Hands so scoring doesn't rescan them
+	@property
+	def p_hand(self):
+		return self._p_hand
+
+	@p_hand.setter
+	def p_hand(self, hand):
+		if not isinstance(hand, Hand):
+			hand = Hand(hand)
+		self._p_hand = hand
+
+	@property
+	def d_hand(self):
+		return self._d_hand
+
+	@d_hand.setter
+	def d_hand(self, hand):
+		if not isinstance(hand, Hand):
+			hand = Hand(hand)
+		self._d_hand = hand
+
 	def play(self, bet = None):
 		doubled_down = 1
 		can_double_down = False
@@ -49,115 +411,103 @@ class Game:
 		self.player_draw()
 		self.dealer_draw()
 		self.dealer_draw()
+		self.sink.emit("deal", self)
 
 		# on first move selection, if player hand is worth 9, 10, or 11 they may double down
 		if self.score_p_hand() >= 9 and self.score_p_hand() <= 11:
 			can_double_down = True
 
 		if bet is None:
-			print("Available Funds: ${0:.2f}\nEnter Bet Amount: ".format(self.budget + self.winnings))
-			bet = float(input())
-			while bet > self.budget + self.winnings:
-				print("You can not bet more than the amount of money you have.\nAvailable Funds: ${}\nEnter Bet Amount: ".format(self.budget + self.winnings))
-				bet = float(input())
+			bet = self.sink.ask_bet(self)
 
 		if bet > self.budget + self.winnings:
 			raise ValueError("You can not bet more than the amount of money you have. \nAttempted Bet: {}\nAvailable Funds: {}".format(bet, self.budget + self.winnings))
 
 		#if first two cards are 21, player automatically wins 1.5x bet instead of 2x
-		if self.score_p_hand() == 21:
+		if self.p_hand.is_blackjack:
 			self.turn = "End"
-			self.print_hands()
-			if self.score_d_hand() != 21:
-				print("Blackjack! You win 1.5x your bet!")
+			self.sink.emit("hands", self)
+			if not self.d_hand.is_blackjack:
 				self.winnings += bet * 1.5
+				self.sink.emit("result", self, outcome = "blackjack", amount = bet * 1.5)
 			else:
-				print("Stand-off: Your bet has been returned.")
+				self.sink.emit("result", self, outcome = "standoff", amount = 0.0)
 			self.turn = "Player"
 			return
 		#if dealer has 21 on first hand and player doesn't, dealer wins
-		elif self.score_d_hand() == 21:
+		elif self.d_hand.is_blackjack:
 			self.turn = "End"
-			self.print_hands()
-			print("Dealer Blackjack. You Lose.")
+			self.sink.emit("hands", self)
 			self.winnings -= bet
+			self.sink.emit("result", self, outcome = "dealer blackjack", amount = -bet)
 			self.turn = "Player"
 			return
 
 
-		while self.turn is not "End":
-			self.print_hands()
+		while self.turn != "End":
+			self.sink.emit("hands", self)
 
 			if self.turn == "Player":
-				
-				if can_double_down:
-					print("\n\nSelect an action:\n1) Hit\n2) Stay\n3) Double Down")
-					action = int(input())
-					while action < 1 or action > 3:
-						print("\n\nSelect an action:\n1) Hit\n2) Stay\n3) Double Down")
-						action = int(input())
-
-				else:
-					print("\n\nSelect an action:\n1) Hit\n2) Stay")
-					action = int(input())
-					while action < 1 or action > 2:
-						print("\n\nSelect an action:\n1) Hit\n2) Stay")
-						action = int(input())
-
+				action = self.sink.ask_action(self, can_double_down)
 				can_double_down = False
 
 				#~~~~~~~~~~~~~ Hit ~~~~~~~~~~~~~
 				if action == 1: 
+					self.sink.emit("action", self, action = "Ph")
 					self.player_draw()
-					if self.score_p_hand() > 21:
+					if self.p_hand.is_bust:
 						self.turn = 'End'
 
 				#~~~~~~~~~~~~~ Stay ~~~~~~~~~~~~~
 				elif action == 2:
+					self.sink.emit("action", self, action = "Ps")
 					self.turn = 'Dealer'
 
 				#~~~~~~~~~~~~~ Double Down ~~~~~~~~~~~~~
 				elif action == 3:
+					self.sink.emit("action", self, action = "Pd")
 					doubled_down = 2
 					self.player_draw()
-					if self.score_p_hand() > 21:
+					if self.p_hand.is_bust:
 						self.turn = 'End'
 					else:
 						self.turn = 'Dealer'
 
 			elif self.turn == "Dealer":
 				# Hit if not bust yet, hand value is less than player's, and dealer stay rule has not been reached
-				if self.score_d_hand() < self.d_stay and self.score_d_hand() <= self.score_p_hand() and self.score_d_hand() < 21:
-					print("~~~~~~~~ Dealer Hits ~~~~~~~~")
+				d_score = self.d_hand.value
+				if d_score < self.d_stay and d_score <= self.p_hand.value and d_score < 21:
+					self.sink.emit("dealer_hit", self)
 					self.dealer_draw()
 				# else stay
 				else:
-					print("~~~~~~~~ Dealer Stays ~~~~~~~~")
+					self.sink.emit("dealer_stay", self)
 					self.turn = 'End'
 
 			# Failsafe for invalid turn state: Just end the game
 			else:
-				print("Invalid Turn State: Game Ending")
+				self.sink.emit("invalid_turn", self)
 				self.turn = 'End'
 
 		#Hand has ended: Evaluate Result
-		print("\nEnd State Reached")
-		self.print_hands()
-		print("   Dealer Score: {}\n   Player Score: {}".format(self.score_d_hand(), self.score_p_hand()))
+		self.sink.emit("end", self)
+
+		p_score = self.p_hand.value
+		d_score = self.d_hand.value
 
 		# Player Loss Condition
-		if self.score_p_hand() > 21 or (self.score_p_hand() < self.score_d_hand() and self.score_d_hand() <= 21):
-			print("You Lose")
+		if p_score > 21 or (p_score < d_score and d_score <= 21):
 			self.winnings -= bet * doubled_down
+			self.sink.emit("result", self, outcome = "lose", amount = -bet * doubled_down)
 
 		# Draw Condition
-		elif self.score_p_hand() == self.score_d_hand():
-			print("Draw")
+		elif p_score == d_score:
+			self.sink.emit("result", self, outcome = "draw", amount = 0.0)
 
 		# Player Win Condition
-		elif self.score_p_hand() > self.score_d_hand() or self.score_d_hand() > 21:
-			print("You Win")
+		elif p_score > d_score or d_score > 21:
 			self.winnings += bet * doubled_down
+			self.sink.emit("result", self, outcome = "win", amount = bet * doubled_down)
 
 		self.turn = "Player"
 
@@ -185,101 +535,34 @@ class Game:
 
 
 	def player_draw(self, value = None):
-		if value is None:
-			if self.deck_is_empty():
-				raise ValueError('Deck is empty: Cannot draw a card.')
-
-			eligible_values = []
-			tempdeck = []
-			for i in range(0,10):
-				if self.deck[i] > 0:
-					eligible_values.append(i)
-					tempdeck.append(self.deck[i])
-
-			value = random.choices(eligible_values, weights = tempdeck, k = 1)
-
-		if self.deck[value[0]] <= 0:
-			raise ValueError("Deck has no more {}'s to draw.".format(self.convert_value_to_card(value[0])))
-
-		self.deck[value[0]] = self.deck[value[0]] - 1
-		self.p_hand.append(value[0])
+		self.p_hand.append(self.take_card(value))
 
 	def dealer_draw(self, value = None):
-		if value is None:
-			if self.deck_is_empty():
-				raise ValueError('Deck is empty: Cannot draw a card.')
+		self.d_hand.append(self.take_card(value))
 
-			eligible_values = []
-			tempdeck = []
-			for i in range(0,10):
-				if self.deck[i] > 0:
-					eligible_values.append(i)
-					tempdeck.append(self.deck[i])
+	# remove a card from the deck: a random one if value is None, otherwise that value
+	def take_card(self, value = None):
+		if value is None:
+			return self.deck.draw()
 
-			value = random.choices(eligible_values, weights = tempdeck, k = 1)
+		# older callers pass the value wrapped in a list, as random.choices returns it
+		if isinstance(value, list):
+			value = value[0]
 
-		if self.deck[value[0]] <= 0:
-			raise ValueError("Deck has no more {}'s to draw.".format(self.convert_value_to_card(value[0])))
+		if self.deck[value] <= 0:
+			raise ValueError("Deck has no more {}'s to draw.".format(self.convert_value_to_card(value)))
 
-		self.deck[value[0]] = self.deck[value[0]] - 1
-		self.d_hand.append(value[0])
+		self.deck[value] = self.deck[value] - 1
+		return value
 
 	def score_p_hand(self):
-		numAces = 0
-		score = 0
-
-		#score all cards as value except for aces, which must be scored last.
-		#track number of aces for later
-		for card in self.p_hand:
-			if card == 0:
-				numAces += 1
-			else:
-				score += card + 1
-
-		#we will never score more than one ace as 11, so all but one will be worth 1
-		if numAces > 1:
-			score += numAces - 1
-			numAces = 1
-
-		#if score is greater than 10, adding 11 will bust, so we score the last ace as 1.
-		#otherwise, we score the final ace as 11
-		if numAces == 1:
-			if score > 10:
-				score += 1
-			else:
-				score += 11
-
-		return score
+		return self.p_hand.value
 
 	def score_d_hand(self):
-		numAces = 0
-		score = 0
-
-		#score all cards as value except for aces, which must be scored last.
-		#track number of aces for later
-		for card in self.d_hand:
-			if card == 0:
-				numAces += 1
-			else:
-				score += card + 1
-
-		#we will never score more than one ace as 11, so all but one will be worth 1
-		if numAces > 1:
-			score += numAces - 1
-			numAces = 1
-
-		#if score is greater than 10, adding 11 will bust, so we score the last ace as 1.
-		#otherwise, we score the final ace as 11
-		if numAces == 1:
-			if score > 10:
-				score += 1
-			else:
-				score += 11
+		return self.d_hand.value
 
-		return score
-		
 	def deck_is_empty(self):
-		return self.deck == ([0] * 10)
+		return self.deck.total == 0
 
 	def add_deck(self, deck = None):
 		if deck is None:
@@ -344,6 +627,81 @@ class TestBlackjackClass(unittest.TestCase):
 		with self.assertRaises(ValueError, msg="Deck has no more 2's to draw."):
 			game.dealer_draw(1)
 
+	def test_shoe(self):
+		shoe = Shoe([1,0,2,0,0,0,0,0,0,3])
+		self.assertEqual(6, shoe.total)
+		self.assertEqual([0, 2, 2, 9, 9, 9], [shoe.select(u) for u in range(6)])
+
+		shoe[2] -= 2
+		shoe[4] = 5
+		self.assertEqual([1,0,0,0,5,0,0,0,0,3], shoe)
+		self.assertEqual([0, 4, 4, 4, 4, 4, 9, 9, 9], [shoe.select(u) for u in range(9)])
+
+		copy = shoe.copy()
+		drawn = copy.draw_many(9)
+		self.assertEqual([0] * 10, copy)
+		self.assertEqual(9, shoe.total)
+		self.assertEqual(sorted(drawn), [0, 4, 4, 4, 4, 4, 9, 9, 9])
+		with self.assertRaises(ValueError):
+			copy.draw()
+
+	def test_random_stream(self):
+		stream = RandomStream(7, block_size = 16)
+		numbers = [stream.random() for i in range(40)]
+		self.assertTrue(all(0 <= u < 1 for u in numbers))
+		# reseeding replays the same numbers across block refills
+		stream.seed(7)
+		self.assertEqual(numbers, [stream.random() for i in range(40)])
+		self.assertNotEqual(numbers, [RandomStream(8, block_size = 16).random() for i in range(40)])
+
+		picks = [stream.pick([0, 1, 0, 3]) for i in range(400)]
+		self.assertEqual({1, 3}, set(picks))
+		self.assertTrue(picks.count(3) > picks.count(1))
+
+		# a spawned stream leaves its parent where it was, and spawns are reproducible
+		stream.seed(7)
+		child = stream.spawn()
+		child_numbers = [child.random() for i in range(40)]
+		self.assertEqual(numbers, [stream.random() for i in range(40)])
+		stream.seed(7)
+		child = stream.spawn()
+		self.assertEqual(child_numbers, [child.random() for i in range(40)])
+		self.assertNotEqual(numbers, child_numbers)
+
+		shoe = Shoe(stream = child)
+		self.assertIs(child, shoe.copy().stream)
+		self.assertIs(default_stream, Shoe().stream)
+
+	def test_counter_sink(self):
+		sink = CounterSink()
+		game = Game(deck = [0,0,0,0,0,0,0,0,0,16], d_stay = 17, sink = sink)
+		sink.ask_action = lambda game, can_double_down: 2
+		game.play(bet = 1)
+		self.assertEqual({"deal": 1, "hands": 2, "action": 1, "dealer_stay": 1, "end": 1, "result": 1}, sink.counts)
+		self.assertEqual({"draw": 1}, sink.results)
+
+		with self.assertRaises(ValueError):
+			Game(sink = NullSink()).play()
+
+	def test_hand(self):
+		hand = Hand([0])
+		self.assertTrue(hand.is_soft)
+		hand.append(9)
+		self.assertEqual((21, True, False, True), (hand.value, hand.is_soft, hand.is_bust, hand.is_blackjack))
+		hand.append(4)
+		self.assertEqual((16, False, False, False), (hand.value, hand.is_soft, hand.is_bust, hand.is_blackjack))
+		hand.append(9)
+		self.assertTrue(hand.is_bust)
+		hand.pop()
+		hand[0] = 5
+		self.assertEqual((21, 3), (hand.value, len(hand)))
+		self.assertFalse(hand.is_blackjack)
+
+		game = Game(p_hand = [0, 5])
+		game.p_hand = game.p_hand[:-1]
+		self.assertTrue(isinstance(game.p_hand, Hand))
+		self.assertEqual(11, game.score_p_hand())
+
 	def test_score_p_hand(self):
 		game = Game()
 		self.assertEqual(0, game.score_p_hand())
@@ -0,0 +1,190 @@
+# Vectorized batch rollouts for blackjack
+#
+# Plays thousands of rollouts at once as NumPy arrays instead of one at a
+# time through the tree. Each row is an independent rollout with its own
+# deck counts, hard totals, ace flags and turn code; every step of the loop
+# advances all unfinished rows together.
+#
+# Rules follow blackjack_mcts: the dealer hits while below d_stay, not above
+# the player and not at 21 (get_possible_actions), results are scored like
+# get_score and paid like update_balance (double down pays and loses 2x).
+
+from blackjack import default_stream
+import numpy as np
+
+PLAYER = 0
+DEALER = 1
+END = 2
+
+# vectorized Game.score_p_hand on hard totals and ace flags
+def score_hands(hard, ace):
+  return hard + 10 * (ace & (hard <= 11))
+
+# draw one card for every selected row, weighted by that row's deck counts
+def draw_cards(decks, rows, rng):
+  cumulative = np.cumsum(decks[rows], axis = 1)
+  picks = rng.integers(0, cumulative[:, -1])
+  values = (cumulative <= picks[:, None]).sum(axis = 1)
+  decks[rows, values] -= 1
+  return values
+
+# result of each finished rollout, in units of the bet
+#   -1/-2: player loss
+#       0: draw
+#    1/ 2: player win
+def score_results(p_hard, p_ace, d_hard, d_ace, doubled):
+  p_score = score_hands(p_hard, p_ace)
+  d_score = score_hands(d_hard, d_ace)
+  mod = np.where(doubled, 2, 1)
+  loss = (p_score > 21) | ((p_score < d_score) & (d_score <= 21))
+  draw = ~loss & (p_score == d_score)
+  return np.where(loss, -mod, np.where(draw, 0, mod))
+
+# count orders the rest of the deck could come out in, one row each, cut to
+# the first length cards (fewer if the deck doesn't have that many)
+def draw_sequences(deck, count, length, rng):
+  decks = np.tile(np.asarray(deck, dtype = np.int32), (count, 1))
+  length = min(length, int(decks[0].sum()))
+  rows = np.arange(count)
+  sequences = np.empty((count, length), dtype = np.int32)
+  for i in range(length):
+    sequences[:, i] = draw_cards(decks, rows, rng)
+  return sequences
+
+# Card source for rollouts: the rows either draw at random from their own
+# deck counts, or deal from pre-drawn sequences (draw_sequences) so that
+# rollouts sharing sequences see exactly the same cards. The player is dealt
+# from the front of a sequence and the dealer from the back, so the dealer
+# gets the same cards whatever the player did.
+class Cards:
+  def __init__(self, deck, count, rng, sequences = None):
+    self.rng = rng
+    self.sequences = sequences
+    if sequences is None:
+      self.decks = np.tile(np.asarray(deck, dtype = np.int32), (count, 1))
+    else:
+      self.front = np.zeros(count, dtype = np.int32)
+      self.back = np.full(count, sequences.shape[1] - 1, dtype = np.int32)
+
+  def draw(self, rows, dealer = False):
+    if self.sequences is None:
+      return draw_cards(self.decks, rows, self.rng)
+    if dealer:
+      values = self.sequences[rows, self.back[rows]]
+      self.back[rows] -= 1
+    else:
+      values = self.sequences[rows, self.front[rows]]
+      self.front[rows] += 1
+    return values
+
+  # which of rows have a card left to draw
+  def available(self, rows):
+    if self.sequences is None:
+      return self.decks[rows].sum(axis = 1) > 0
+    return self.front[rows] <= self.back[rows]
+
+# Play count rollouts from state, all starting with actionCode
+# ("Ph", "Ps" or "Pd"). After the first action the player keeps hitting
+# until their score reaches p_stay.
+# state needs deck, p_total, p_aces, d_total, d_aces and d_stay,
+# like blackjack_mcts.SearchState.
+# sequences, if given, are pre-drawn card orders (one row per rollout) dealt
+# from in place of random draws, see compare_actions.
+# hole deals the dealer's facedown card before the player's first action.
+# Returns the result of every rollout as an int array.
+def rollout(state, actionCode, count = 1000, p_stay = 17, rng = None, sequences = None, hole = False):
+  if rng is None:
+    rng = default_stream.generator
+
+  if sequences is not None:
+    count = len(sequences)
+  cards = Cards(state.deck, count, rng, sequences)
+  p_hard = np.full(count, state.p_total, dtype = np.int32)
+  p_ace = np.full(count, state.p_aces > 0)
+  d_hard = np.full(count, state.d_total, dtype = np.int32)
+  d_ace = np.full(count, state.d_aces > 0)
+  doubled = np.full(count, actionCode == "Pd")
+  turn = np.full(count, PLAYER, dtype = np.int8)
+
+  if hole:
+    values = cards.draw(np.arange(count), dealer = True)
+    d_hard += values + 1
+    d_ace |= values == 0
+
+  # the first move is forced, later player moves follow the p_stay rule
+  if actionCode == "Ps":
+    turn[:] = DEALER
+  elif actionCode == "Ph" or actionCode == "Pd":
+    values = cards.draw(np.arange(count))
+    p_hard += values + 1
+    p_ace |= values == 0
+    bust = score_hands(p_hard, p_ace) > 21
+    if actionCode == "Pd":
+      turn[:] = np.where(bust, END, DEALER)
+    else:
+      turn[bust] = END
+  else:
+    raise ValueError(actionCode + ' is not a valid action.')
+
+  while True:
+    # player hits below p_stay and stays otherwise
+    player = np.flatnonzero(turn == PLAYER)
+    if len(player) > 0:
+      p_score = score_hands(p_hard[player], p_ace[player])
+      staying = player[p_score >= p_stay]
+      turn[staying] = DEALER
+      hitting = player[p_score < p_stay]
+      # a player with an empty deck has to stay
+      turn[hitting[~cards.available(hitting)]] = DEALER
+      hitting = hitting[cards.available(hitting)]
+      if len(hitting) > 0:
+        values = cards.draw(hitting)
+        p_hard[hitting] += values + 1
+        p_ace[hitting] |= values == 0
+        turn[hitting[score_hands(p_hard[hitting], p_ace[hitting]) > 21]] = END
+
+    # dealer hits if not bust yet, hand value is less than player's and less than stay limit
+    dealer = np.flatnonzero(turn == DEALER)
+    if len(dealer) > 0:
+      d_score = score_hands(d_hard[dealer], d_ace[dealer])
+      p_score = score_hands(p_hard[dealer], p_ace[dealer])
+      hits = (d_score < state.d_stay) & (d_score <= p_score) & (d_score < 21)
+      # a dealer with an empty deck has to stay
+      hits &= cards.available(dealer)
+      turn[dealer[~hits]] = END
+      hitting = dealer[hits]
+      if len(hitting) > 0:
+        values = cards.draw(hitting, dealer = True)
+        d_hard[hitting] += values + 1
+        d_ace[hitting] |= values == 0
+
+    if len(player) == 0 and len(dealer) == 0:
+      break
+
+  return score_results(p_hard, p_ace, d_hard, d_ace, doubled)
+
+# aggregate results the way Metrics.update would: (wins, draws, played)
+def get_totals(results):
+  wins = int(results[results > 0].sum())
+  draws = int((results == 0).sum())
+  played = int(np.maximum(1, np.abs(results)).sum())
+  return wins, draws, played
+
+# Common random numbers: every action in actionCodes is played against the
+# same count pre-drawn card orders, so row i of every result array saw the
+# same shoe and differences between actions are paired rather than
+# independent. With hole set the dealer is showing one card: their facedown
+# card is the first one they are dealt, and orders that give the dealer
+# blackjack are dropped because the hand would have ended before any decision.
+# Returns {actionCode: results}, all arrays of the same length.
+def compare_actions(state, actionCodes, count = 1000, p_stay = 17, rng = None, hole = False, length = 24):
+  if rng is None:
+    rng = default_stream.generator
+
+  sequences = draw_sequences(state.deck, count, length, rng)
+  if hole:
+    d_hard = state.d_total + sequences[:, -1] + 1
+    d_ace = (state.d_aces > 0) | (sequences[:, -1] == 0)
+    sequences = sequences[score_hands(d_hard, d_ace) != 21]
+
+  return {a: rollout(state, a, p_stay = p_stay, rng = rng, sequences = sequences, hole = hole) for a in actionCodes}
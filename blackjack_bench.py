@@ -0,0 +1,185 @@
+# Benchmark suite
+#
+# Canned workloads with fixed seeds for the hot paths of blackjack.py and
+# blackjack_mcts.py. Results can be saved as a baseline and later runs
+# compared against it, flagging anything that got slower than threshold.
+#
+#   python blackjack_bench.py --save baseline.json
+#   python blackjack_bench.py --compare baseline.json --threshold 0.1
+
+from blackjack import Game, NullSink, default_stream
+from blackjack_mcts import run_simulations, reccomend_action, make_n_decks, NodeStore
+import blackjack_sim
+import blackjack_exact
+import argparse
+import json
+import random
+import time
+import unittest
+import numpy as np
+
+def seed_all(seed):
+  random.seed(seed)
+  default_stream.seed(seed)
+
+# a result: value, unit and which direction is an improvement
+def result(value, unit, higher_is_better = True):
+  return {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+
+def bench_draws(cards = 200000):
+  seed_all(0)
+  game = Game(deck = make_n_decks(8), sink = NullSink())
+  start = time.perf_counter()
+  for i in range(cards // 2):
+    if game.deck.total < 2:
+      game.deck = make_n_decks(8)
+      game.p_hand = []
+      game.d_hand = []
+    game.player_draw()
+    game.dealer_draw()
+  seconds = time.perf_counter() - start
+  return {"draws_per_second": result(cards / seconds, "draws/s")}
+
+def bench_scoring(hands = 200000):
+  seed_all(0)
+  games = []
+  for i in range(100):
+    game = Game(deck = make_n_decks(8), sink = NullSink())
+    for j in range(random.randint(2, 5)):
+      game.player_draw()
+    games.append(game)
+  start = time.perf_counter()
+  for i in range(hands // len(games)):
+    for game in games:
+      game.score_p_hand()
+  seconds = time.perf_counter() - start
+  return {"scores_per_second": result(hands / seconds, "scores/s")}
+
+# the opening decision on 10 5 against a dealer 10
+def get_search_game(numdecks):
+  deck = make_n_decks(numdecks)
+  game = Game(deck = deck, p_hand = [9, 4], d_hand = [9], d_stay = 17, sink = NullSink())
+  for card in game.p_hand + game.d_hand:
+    game.deck[card] -= 1
+  return game
+
+def bench_rollouts(count = 2000, deck_counts = (1, 4, 8)):
+  results = {}
+  for exact_dealer, name in ((False, "rollouts_per_second_{}_decks"), (True, "exact_dealer_rollouts_{}_decks")):
+    blackjack_exact.clear_cache()
+    for numdecks in deck_counts:
+      seed_all(0)
+      game = get_search_game(numdecks)
+      start = time.perf_counter()
+      run_simulations(game, "", NodeStore(), count, progress = False, exact_dealer = exact_dealer)
+      seconds = time.perf_counter() - start
+      results[name.format(numdecks)] = result(count / seconds, "rollouts/s")
+  return results
+
+def bench_recommendations(decisions = 20, count = 1000):
+  seed_all(0)
+  game = Game(deck = make_n_decks(4), d_stay = 17, sink = NullSink())
+  latencies = []
+  while len(latencies) < decisions:
+    if game.deck.total < 52:
+      game.deck = make_n_decks(4)
+    game.p_hand = []
+    game.d_hand = []
+    game.player_draw()
+    game.player_draw()
+    game.dealer_draw()
+    game.dealer_draw()
+    if game.p_hand.is_blackjack or game.d_hand.is_blackjack:
+      continue
+    start = time.perf_counter()
+    reccomend_action(game, "", count = count)
+    latencies.append((time.perf_counter() - start) * 1000)
+
+  return {"recommendation_p50_ms": result(float(np.percentile(latencies, 50)), "ms", False),
+          "recommendation_p90_ms": result(float(np.percentile(latencies, 90)), "ms", False),
+          "recommendation_p99_ms": result(float(np.percentile(latencies, 99)), "ms", False)}
+
+def bench_shoes(shoes = 200):
+  stats = blackjack_sim.simulate(shoes, policy = "table", seed = 0)
+  return {"hands_per_second": result(stats["hands_per_second"], "hands/s")}
+
+benchmarks = {
+  "draws": bench_draws,
+  "scoring": bench_scoring,
+  "rollouts": bench_rollouts,
+  "recommendations": bench_recommendations,
+  "shoes": bench_shoes,
+}
+
+def run_benchmarks(names = None):
+  results = {}
+  for name in names or benchmarks:
+    results.update(benchmarks[name]())
+  return results
+
+# Compare results with a baseline. Returns (name, baseline, current, change)
+# for every metric that got worse by more than threshold (0.1 = 10%).
+def find_regressions(baseline, results, threshold = 0.1):
+  regressions = []
+  for name, current in results.items():
+    if name not in baseline:
+      continue
+    old = baseline[name]["value"]
+    new = current["value"]
+    if old <= 0:
+      continue
+    change = (new - old) / old
+    if not current["higher_is_better"]:
+      change = -change
+    if change < -threshold:
+      regressions.append((name, old, new, change))
+  return regressions
+
+def format_results(results, baseline = None):
+  lines = []
+  for name, current in results.items():
+    line = "{:32s} {:14.2f} {}".format(name, current["value"], current["unit"])
+    if baseline is not None and name in baseline:
+      line += "  (baseline {:.2f})".format(baseline[name]["value"])
+    lines.append(line)
+  return "\n".join(lines)
+
+class TestBenchmarks(unittest.TestCase):
+
+  def test_find_regressions(self):
+    baseline = {"a": result(100.0, "x/s"), "b": result(10.0, "ms", False), "c": result(5.0, "x/s")}
+    results = {"a": result(85.0, "x/s"), "b": result(12.0, "ms", False), "c": result(4.8, "x/s"), "d": result(1.0, "x/s")}
+    regressions = find_regressions(baseline, results, threshold = 0.1)
+    self.assertEqual(["a", "b"], [r[0] for r in regressions])
+    self.assertAlmostEqual(-0.15, regressions[0][3])
+    self.assertAlmostEqual(-0.2, regressions[1][3])
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description = "Blackjack engine benchmarks")
+  parser.add_argument("benchmarks", nargs = "*", help = "benchmarks to run: " + ", ".join(benchmarks) + " (default: all)")
+  parser.add_argument("--save", metavar = "FILE", help = "save results as a baseline")
+  parser.add_argument("--compare", metavar = "FILE", help = "compare results with a saved baseline")
+  parser.add_argument("--threshold", type = float, default = 0.1, help = "allowed slowdown before flagging a regression")
+  args = parser.parse_args()
+  for name in args.benchmarks:
+    if name not in benchmarks:
+      parser.error("unknown benchmark " + name)
+
+  results = run_benchmarks(args.benchmarks)
+
+  baseline = None
+  if args.compare:
+    with open(args.compare) as f:
+      baseline = json.load(f)
+  print(format_results(results, baseline))
+
+  if args.save:
+    with open(args.save, "w") as f:
+      json.dump(results, f, indent = 2)
+
+  if baseline is not None:
+    regressions = find_regressions(baseline, results, args.threshold)
+    for name, old, new, change in regressions:
+      print("REGRESSION {}: {:.2f} -> {:.2f} ({:+.1%})".format(name, old, new, change))
+    if regressions:
+      raise SystemExit(1)
@@ -8,15 +8,29 @@
 # Morgan Swanson for Dr. Franz Kurfess's CSC 480
 
 from blackjack import *
-import random
+import blackjack_exact
+import blackjack_batch
 import numpy as np 
 import math
-import copy
+from array import array
 from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor
+import os
+import sys
+import time
+from statistics import NormalDist
+from collections import OrderedDict
+import heapq
+import threading
 import csv
+import atexit
 
 aggression = 1.0
 
+# process pool shared by parallel searches, created on first use
+worker_pool = None
+worker_pool_size = 0
+
 def get_possible_actions(game, action_history):
   actions = []
   if game.turn == "Player":
@@ -59,6 +73,12 @@ class Metrics:
     elif result > 0:
       self.wins = self.wins + result
 
+  # add totals, e.g. the expected update from get_expected_counts
+  def add(self, wins, draws, played):
+    self.wins = self.wins + wins
+    self.draws = self.draws + draws
+    self.played = self.played + played
+
   # get the win percentage of a metric
   # a draw is worth something, but less than a win, 
   # so we skew to more draws than losses if needed
@@ -73,7 +93,8 @@ class Metrics:
     if self.played > 0:
       #c times the square root of natural log of sims run by parent
       #divided by sims run by this state
-      return c * (math.log(parent.played) / self.played) ** .5 
+      #(a node seeded by a NodePrior can be played before its parent is)
+      return c * (math.log(max(1, parent.played)) / self.played) ** .5 
     else:
       return 0
 
@@ -85,41 +106,494 @@ class Metrics:
     else:
       return default
 
-def select_action(game, actions, action_history):
-  possible_actions = get_possible_actions(game, actions)
+  # normal approximation confidence interval around the win percentage
+  # z = 1.96 gives a 95% interval
+  def get_confidence_interval(self, z = 1.96):
+    if self.played <= 0:
+      return (0.0, 1.0)
+    p = min(1.0, max(0.0, self.get_win_percentage()))
+    margin = z * (p * (1 - p) / self.played) ** .5
+    return (p - margin, p + margin)
+
+# action codes stored per tree node, in child slot order
+ACTION_CODES = ["Ph", "Ps", "Pd", "Dh", "Ds"]
+PLAYER_HIT, PLAYER_STAY, PLAYER_DOUBLE, DEALER_HIT, DEALER_STAY = range(5)
+
+# Search tree stored as parallel typed arrays indexed by integer node id.
+# A node is its parent, the action code that reached it, its played/wins/draws
+# counts (with the same meaning as Metrics) and one child slot per action code.
+# Node 0 is the root, which stands for the action history root_actions.
+#
+# It can be passed anywhere an action_history dict is used. Indexing it with
+# an action string returns a Metrics snapshot of that node.
+class NodeStore:
+  __slots__ = ('root_actions', 'parent', 'action', 'played', 'wins', 'draws', 'children')
+
+  def __init__(self, root_actions = ""):
+    self.root_actions = root_actions
+    self.parent = array('i')
+    self.action = array('b')
+    self.played = array('d')
+    self.wins = array('d')
+    self.draws = array('d')
+    self.children = array('i')
+    self.add_node(-1, -1)
+
+  def __len__(self):
+    return len(self.parent)
+
+  def add_node(self, parent, code):
+    node = len(self.parent)
+    self.parent.append(parent)
+    self.action.append(code)
+    self.played.append(0.0)
+    self.wins.append(0.0)
+    self.draws.append(0.0)
+    self.children.extend((-1,) * len(ACTION_CODES))
+    if parent >= 0:
+      self.children[parent * len(ACTION_CODES) + code] = node
+    return node
+
+  # child of node reached by code, created if it doesn't exist yet
+  def get_child(self, node, code):
+    child = self.children[node * len(ACTION_CODES) + code]
+    if child < 0:
+      child = self.add_node(node, code)
+    return child
+
+  # node for an action history string, or -1 if it isn't in the tree
+  def find(self, actions, create = False):
+    if not actions.startswith(self.root_actions):
+      return -1
+    node = 0
+    for i in range(len(self.root_actions), len(actions), 2):
+      code = ACTION_CODES.index(actions[i:i + 2])
+      if create:
+        node = self.get_child(node, code)
+      else:
+        node = self.children[node * len(ACTION_CODES) + code]
+        if node < 0:
+          return -1
+    return node
+
+  def get_actions(self, node):
+    codes = []
+    while node > 0:
+      codes.append(ACTION_CODES[self.action[node]])
+      node = self.parent[node]
+    return self.root_actions + "".join(reversed(codes))
+
+  # same bookkeeping as Metrics.update
+  def update(self, node, result):
+    self.played[node] += max(1, abs(result))
+    if result == 0:
+      self.draws[node] += 1
+    elif result > 0:
+      self.wins[node] += result
 
-  # initialize policy vector beginning with equal chance for all possible actions
-  policy_vector = np.ones(len(possible_actions)) / len(possible_actions)
+  def add(self, node, wins, draws, played):
+    self.wins[node] += wins
+    self.draws[node] += draws
+    self.played[node] += played
 
-  # fill policy vector with all UCBs
-  i = 0
-  for a in possible_actions:
-    # if we haven't done this combination of moves yet, init metrics
-    if a not in action_history:
-      action_history[a] = Metrics()
-    policy_vector[i] = action_history[a].get_upper_confidence_bound(action_history[actions])
-    
-    # adjust policy vector by aggression factor
-    if a[-2:] == 'Ph' or a[-2:] == 'Pd':
-      policy_vector[i] *= aggression
-    elif a[-2:] == 'Ps':
-      policy_vector[i] /= aggression
+  def get_win_percentage(self, node):
+    if self.played[node] == 0:
+      return -1
+    return (self.wins[node] + (self.draws[node] / 2)) / self.played[node]
+
+  # same as Metrics.get_upper_confidence_bound
+  def get_upper_confidence_bound(self, node, parent, default = 6, c = 1.41):
+    played = self.played[node]
+    if played > 0:
+      return ((self.wins[node] + (self.draws[node] / 2)) / played
+              + c * (math.log(max(1, self.played[parent])) / played) ** .5)
+    else:
+      return default
 
-    i += 1
+  def get_metrics(self, node):
+    metrics = Metrics()
+    metrics.wins = self.wins[node]
+    metrics.draws = self.draws[node]
+    metrics.played = self.played[node]
+    return metrics
+
+  # (wins, draws, played) for every node, keyed by action string
+  def get_totals(self):
+    return {self.get_actions(n): (self.wins[n], self.draws[n], self.played[n]) for n in range(len(self))}
+
+  def keys(self):
+    return [self.get_actions(n) for n in range(len(self))]
+
+  def __contains__(self, actions):
+    return self.find(actions) >= 0
+
+  def __getitem__(self, actions):
+    node = self.find(actions)
+    if node < 0:
+      raise KeyError(actions)
+    return self.get_metrics(node)
+
+  def __setitem__(self, actions, metrics):
+    node = self.find(actions, create = True)
+    if node < 0:
+      raise KeyError(actions)
+    self.wins[node] = metrics.wins
+    self.draws[node] = metrics.draws
+    self.played[node] = metrics.played
+
+  # Keep only the subtree under actions, scaling its counts by keep and
+  # dropping nodes left with less than one simulation (see reroot_tree).
+  def reroot(self, actions, keep = 0.5):
+    old = (self.parent, self.action, self.played, self.wins, self.draws, self.children)
+    root = self.find(actions)
+    NodeStore.__init__(self, actions)
+    if root < 0 or old[2][root] * keep < 1:
+      return
 
-  # convert UCBs to selection probabilities
-  policy_sum = np.sum(policy_vector)
-  if policy_sum != 0:
-    policy_vector = policy_vector / policy_sum
-  else:
-    # choose randomly if you can't win
-    policy_vector = np.ones(len(possible_actions)) / len(possible_actions)
+    parent, action, played, wins, draws, children = old
+    self.add(0, wins[root] * keep, draws[root] * keep, played[root] * keep)
+    stack = [(root, 0)]
+    while stack:
+      old_node, new_node = stack.pop()
+      for code in range(len(ACTION_CODES)):
+        old_child = children[old_node * len(ACTION_CODES) + code]
+        if old_child >= 0 and played[old_child] * keep >= 1:
+          new_child = self.add_node(new_node, code)
+          self.add(new_child, wins[old_child] * keep, draws[old_child] * keep, played[old_child] * keep)
+          stack.append((old_child, new_child))
+
+  # Evict all but the max_nodes most visited nodes, always keeping the path
+  # from the root to node keep. Nodes are kept best first from the root, so
+  # every kept node's parent is kept too; their statistics are unchanged.
+  # Returns the new id of keep.
+  def prune(self, max_nodes, keep = 0):
+    if len(self) <= max_nodes:
+      return keep
+    parent, action, played, wins, draws, children = (self.parent, self.action, self.played, self.wins, self.draws,
+                                                     self.children)
+    path = set()
+    node = keep
+    while node >= 0:
+      path.add(node)
+      node = parent[node]
+
+    NodeStore.__init__(self, self.root_actions)
+    self.add(0, wins[0], draws[0], played[0])
+    new_keep = 0
+    # (priority, old node, new parent), the path to keep goes first
+    heap = [(-math.inf if c in path else -played[c], c, 0)
+            for c in children[0:len(ACTION_CODES)] if c >= 0]
+    heapq.heapify(heap)
+    while heap and (len(self) < max_nodes or heap[0][0] == -math.inf):
+      priority, old_node, new_parent = heapq.heappop(heap)
+      new_node = self.add_node(new_parent, action[old_node])
+      self.add(new_node, wins[old_node], draws[old_node], played[old_node])
+      if old_node == keep:
+        new_keep = new_node
+      for c in children[old_node * len(ACTION_CODES):(old_node + 1) * len(ACTION_CODES)]:
+        if c >= 0:
+          heapq.heappush(heap, (-math.inf if c in path else -played[c], c, new_node))
+    return new_keep
+
+# Transposition table: statistics for taking an action from a canonical game
+# state, shared by every action history that reaches that state. The tree keys
+# nodes by action history only, so "Ph" lumps together every card the player
+# might have drawn, and histories that arrive at the same position never pool
+# what they learn. Player decisions looked up here converge together instead.
+#
+# A state is the player's hard total and ace flag, the dealer's upcard, whether
+# this is the first action (double down allowed) and the true count of the
+# remaining deck rounded to a whole number. The dealer's facedown card is left
+# out of both: the player hasn't seen it, so the hole card branches of
+# run_hole_search must share entries. States without a d_up fall back to the
+# dealer's hard total and ace flag.
+class TranspositionTable:
+  __slots__ = ('entries', 'visits')
 
-  # randomly select an action based on probabilities stored in policy vector
-  selected_action = possible_actions[np.random.choice(np.arange(len(possible_actions), dtype=int),
-                                    1, 
-                                    p=policy_vector)[0]]
-  return selected_action
+  def __init__(self):
+    # (state, action code) -> [wins, draws, played], state -> played
+    self.entries = {}
+    self.visits = {}
+
+  def __len__(self):
+    return len(self.entries)
+
+  @staticmethod
+  def get_key(state, first_action):
+    deck = state.deck
+    total = deck.total
+    if state.d_up:
+      dealer = state.d_up
+      if state.d_total > state.d_up:
+        # the facedown card has been dealt, count it as still in the deck
+        deck = list(deck)
+        deck[state.d_total - state.d_up - 1] += 1
+        total += 1
+    else:
+      dealer = (state.d_total, state.d_aces > 0)
+    bucket = round(evaluate_deck(deck, total / 52.0)) if total > 0 else 0
+    return (state.p_total, state.p_aces > 0, dealer, first_action, bucket)
+
+  # same as Metrics.get_upper_confidence_bound for the action from this state
+  def get_upper_confidence_bound(self, key, code, default = 6, c = 1.41):
+    entry = self.entries.get((key, code))
+    if entry is None or entry[2] <= 0:
+      return default
+    wins, draws, played = entry
+    return (wins + (draws / 2)) / played + c * (math.log(self.visits[key]) / played) ** .5
+
+  def get_metrics(self, key, code):
+    metrics = Metrics()
+    entry = self.entries.get((key, code))
+    if entry is not None:
+      metrics.wins, metrics.draws, metrics.played = entry
+    return metrics
+
+  # same bookkeeping as Metrics.update
+  def update(self, key, code, result):
+    entry = self.entries.get((key, code))
+    if entry is None:
+      entry = self.entries[(key, code)] = [0, 0, 0]
+    played = max(1, abs(result))
+    entry[2] += played
+    self.visits[key] = self.visits.get(key, 0) + played
+    if result == 0:
+      entry[1] += 1
+    elif result > 0:
+      entry[0] += result
+
+  # same as Metrics.add
+  def add(self, key, code, wins, draws, played):
+    entry = self.entries.get((key, code))
+    if entry is None:
+      entry = self.entries[(key, code)] = [0, 0, 0]
+    entry[0] += wins
+    entry[1] += draws
+    entry[2] += played
+    self.visits[key] = self.visits.get(key, 0) + played
+
+# Compact game state used inside the search tree.
+# Copying a full Game on every tree step costs four lists and an attribute
+# dict, so the search runs on this slotted state instead. Hands are kept as
+# running hard totals plus ace counts, which is all the scoring rules need.
+# It exposes the same draw/score/turn interface as Game, so get_possible_actions,
+# make_move and get_score work on either one.
+class SearchState:
+  __slots__ = ('deck', 'p_total', 'p_aces', 'd_total', 'd_aces', 'd_stay', 'turn', 'doubled', 'd_up')
+
+  # d_up is the value of the dealer's face up card (1-10), which is all the
+  # player gets to see of the dealer's hand
+  def __init__(self, deck = None, p_total = 0, p_aces = 0, d_total = 0, d_aces = 0, d_stay = 21, turn = "Player", doubled = False,
+               d_up = 0):
+    if not isinstance(deck, Shoe):
+      deck = Shoe(deck)
+    self.deck = deck
+    self.p_total = p_total
+    self.p_aces = p_aces
+    self.d_total = d_total
+    self.d_aces = d_aces
+    self.d_stay = d_stay
+    self.turn = turn
+    self.doubled = doubled
+    self.d_up = d_up
+
+  @classmethod
+  def from_game(cls, game, doubled = False):
+    # hard totals count every ace as 1, aces are tracked separately
+    return cls(game.deck.copy(), game.p_hand.hard, game.p_hand.aces, game.d_hand.hard, game.d_hand.aces,
+               game.d_stay, game.turn, doubled, game.d_hand[0] + 1 if game.d_hand else 0)
+
+  def clone(self):
+    state = SearchState.__new__(SearchState)
+    state.deck = self.deck.copy()
+    state.p_total = self.p_total
+    state.p_aces = self.p_aces
+    state.d_total = self.d_total
+    state.d_aces = self.d_aces
+    state.d_stay = self.d_stay
+    state.turn = self.turn
+    state.doubled = self.doubled
+    state.d_up = self.d_up
+    return state
+
+  def player_draw(self):
+    value = self.deck.draw()
+    self.p_total += value + 1
+    if value == 0:
+      self.p_aces += 1
+    return value
+
+  def dealer_draw(self):
+    value = self.deck.draw()
+    self.d_total += value + 1
+    if value == 0:
+      self.d_aces += 1
+    return value
+
+  # same scoring as Game.score_p_hand: one ace is worth 11 if it doesn't bust
+  def score_p_hand(self):
+    if self.p_aces and self.p_total <= 11:
+      return self.p_total + 10
+    return self.p_total
+
+  def score_d_hand(self):
+    if self.d_aces and self.d_total <= 11:
+      return self.d_total + 10
+    return self.d_total
+
+# action codes available from a game state, like get_possible_actions
+# first_action is true while the player hasn't acted yet
+def get_possible_codes(game, first_action):
+  if game.turn == "Player":
+    # on first action selection, if player hand is worth 9, 10, or 11 they may double down
+    if first_action and game.score_p_hand() >= 9 and game.score_p_hand() <= 11:
+      return (PLAYER_HIT, PLAYER_STAY, PLAYER_DOUBLE)
+    return (PLAYER_HIT, PLAYER_STAY)
+
+  elif game.turn == "Dealer":
+    # hits if not bust yet, hand value is less than player's and less than stay limit
+    if game.score_d_hand() < game.d_stay and game.score_d_hand() <= game.score_p_hand() and game.score_d_hand() < 21:
+      return (DEALER_HIT,)
+    return (DEALER_STAY,)
+
+  return ()
+
+# Pick the next child of node with probability proportional to its UCB.
+# Children are node ids and nothing is allocated per step beyond the weight list.
+# with a TranspositionTable, player decisions are scored from the table and
+# the (state, action code) chosen is appended to table_path for the backup
+# with a NodePrior, new player decision nodes start from its virtual counts
+# allowed, if given, limits the choice to those action codes
+def select_child(game, store, node, first_action, table = None, table_path = None, prior = None, allowed = None):
+  codes = get_possible_codes(game, first_action)
+  if allowed is not None:
+    codes = [code for code in codes if code in allowed]
+  if prior is not None and game.turn == "Player":
+    for code in codes:
+      if store.children[node * len(ACTION_CODES) + code] < 0:
+        child = store.add_node(node, code)
+        counts = prior.get_counts(game, code)
+        if counts is not None:
+          store.add(child, counts[0], 0, counts[1])
+  key = None
+  if table is not None and game.turn == "Player":
+    key = table.get_key(game, first_action)
+
+  weights = []
+  for code in codes:
+    if key is None:
+      w = store.get_upper_confidence_bound(store.get_child(node, code), node)
+    else:
+      w = table.get_upper_confidence_bound(key, code)
+    # adjust policy vector by aggression factor
+    if code == PLAYER_HIT or code == PLAYER_DOUBLE:
+      w *= aggression
+    elif code == PLAYER_STAY:
+      w /= aggression
+    weights.append(w)
+
+  # choose randomly if you can't win
+  if sum(weights) == 0:
+    code = game.deck.stream.choice(codes)
+  else:
+    code = codes[game.deck.stream.pick(weights)]
+  if key is not None:
+    table_path.append((key, code))
+  return store.get_child(node, code)
+
+# Fixed strategy table: double 10/11 against a dealer 2-9, hit anything up to 11,
+# stand on 12-16 against a dealer 2-6, stand on hard 17+ and soft 19+.
+# upcard is the value of the dealer's face up card (1-10).
+def basic_strategy(score, soft, upcard, can_double):
+  if can_double and (score == 10 or score == 11) and upcard >= 2 and upcard <= 9:
+    return "Pd"
+  if soft:
+    return "Ph" if score <= 18 and (score <= 17 or upcard >= 9 or upcard == 1) else "Ps"
+  if score <= 11:
+    return "Ph"
+  if score <= 16:
+    return "Ps" if upcard >= 2 and upcard <= 6 else "Ph"
+  return "Ps"
+
+# Rollout policies for the simulation phase below the tree frontier: given
+# a SearchState on the player's turn (never their first action) they return
+# the action code to play. They must not look past state.d_up at the dealer.
+def random_rollout(state):
+  return state.deck.stream.choice((PLAYER_HIT, PLAYER_STAY))
+
+# hit below the dealer's stay limit, like the dealer does
+def threshold_rollout(state):
+  return PLAYER_HIT if state.score_p_hand() < state.d_stay else PLAYER_STAY
+
+def table_rollout(state):
+  score = state.score_p_hand()
+  soft = state.p_aces > 0 and state.p_total <= 11
+  return ACTION_CODES.index(basic_strategy(score, soft, state.d_up, False))
+
+ROLLOUT_POLICIES = {"random": random_rollout, "threshold": threshold_rollout, "table": table_rollout}
+
+# the rollout policy to use for a name in ROLLOUT_POLICIES or a function
+def get_rollout_policy(rollout_policy):
+  if rollout_policy is None or callable(rollout_policy):
+    return rollout_policy
+  if rollout_policy not in ROLLOUT_POLICIES:
+    raise ValueError(str(rollout_policy) + ' is not a valid rollout policy.')
+  return ROLLOUT_POLICIES[rollout_policy]
+
+# Finish a hand from state with policy, without growing the tree.
+# state is changed in place. Returns the result like get_score.
+def play_out(state, policy, exact_dealer = False):
+  result = get_score(state, "Pd" if state.doubled else "")
+  while result is None:
+    if state.turn == "Player":
+      code = policy(state)
+    else:
+      code = get_possible_codes(state, False)[0]
+    make_move(state, ACTION_CODES[code])
+    if exact_dealer and state.turn == "Dealer":
+      settle_dealer(state)
+    result = get_score(state, "Pd" if state.doubled else "")
+  return result
+
+# Progressive bias: new player decision nodes start with weight virtual
+# simulations whose win percentage matches the action's expected value in
+# values, a table of {(score, soft, dealer upcard): (hit, stay, double)}
+# expected values like blackjack_exact.approximate_action_values returns.
+# The real rollouts wash the prior out as a node is visited, so the search
+# starts from the table's answer and spends its budget on close decisions.
+class NodePrior:
+  __slots__ = ('values', 'weight')
+
+  def __init__(self, values, weight = 10):
+    self.values = values
+    self.weight = weight
+
+  # built from the infinite deck approximation for a shoe like game's
+  @classmethod
+  def from_game(cls, game, weight = 10):
+    return cls(blackjack_exact.approximate_action_values(tuple(game.deck), game.d_stay), weight)
+
+  # virtual (wins, played) for taking code from a SearchState, None if there's no prior
+  def get_counts(self, state, code):
+    soft = state.p_aces > 0 and state.p_total <= 11
+    entry = self.values.get((state.score_p_hand(), soft, state.d_up))
+    if entry is None or entry[code] is None:
+      return None
+    # a double down plays for twice the bet, but win percentage is per unit played
+    ev = entry[code] / 2 if code == PLAYER_DOUBLE else entry[code]
+    return (ev + 1) / 2 * self.weight, self.weight
+
+# the prior to use for a NodePrior, "approximate" (NodePrior.from_game) or None
+def get_prior(prior, game):
+  if prior is None or isinstance(prior, NodePrior):
+    return prior
+  if prior != "approximate":
+    raise ValueError(str(prior) + ' is not a valid prior.')
+  return NodePrior.from_game(game)
+
+# simulations a new node reached by code starts with
+def get_prior_played(prior, code):
+  return prior.weight if prior is not None and code <= PLAYER_DOUBLE else 0
 
 #   -1: player loss
 #    0: draw
@@ -150,31 +624,284 @@ def get_score(game, actions):
 
     return None
 
-def run_simulations(game, actions, action_history, count = 1000):
-  if actions not in action_history:
-    action_history[actions] = Metrics()
+# Counters and timings for searches, filled in when passed to run_simulations
+# or reccomend_action as stats. Times are in seconds per phase:
+#   select - choosing the next child by UCB
+#   clone  - copying the search state
+#   move   - applying the action, including drawing cards
+#   score  - checking whether the hand is over
+#   backup - updating statistics along the path
+#   search - whole search, including engines that don't time phases
+class SearchStats:
+  __slots__ = ('rollouts', 'nodes_created', 'nodes_evicted', 'depth_total', 'tree_nodes', 'tree_bytes', 'timings')
 
-  for i in tqdm(range(count), mininterval = 0.2):
-    path = [actions]
-    game_path = [game]
-    result = get_score(game, actions)
+  def __init__(self):
+    self.rollouts = 0
+    self.nodes_created = 0
+    self.nodes_evicted = 0
+    self.depth_total = 0
+    self.tree_nodes = 0
+    self.tree_bytes = 0
+    self.timings = {"select": 0.0, "clone": 0.0, "move": 0.0, "score": 0.0, "backup": 0.0, "search": 0.0}
+
+  # average number of actions taken per rollout
+  def get_average_depth(self):
+    if self.rollouts == 0:
+      return 0.0
+    return self.depth_total / self.rollouts
+
+  def as_dict(self):
+    return {"rollouts": self.rollouts, "nodes_created": self.nodes_created, "nodes_evicted": self.nodes_evicted,
+            "average_depth": self.get_average_depth(), "tree_nodes": self.tree_nodes,
+            "tree_bytes": self.tree_bytes, "timings": dict(self.timings)}
+
+# approximate memory held by a search tree, in bytes
+def get_tree_memory(action_history):
+  if isinstance(action_history, NodeStore):
+    return sum(a.itemsize * len(a) for a in (action_history.parent, action_history.action, action_history.played,
+                                               action_history.wins, action_history.draws, action_history.children))
+  size = sys.getsizeof(action_history)
+  for a, metrics in action_history.items():
+    size += sys.getsizeof(a) + sys.getsizeof(metrics) + sys.getsizeof(metrics.__dict__)
+  return size
+
+# stats, if given, is a SearchStats that collects counters and phase timings
+# table, if given, is a TranspositionTable shared by equivalent player decisions
+# exact_dealer ends a rollout when the dealer's turn starts and backs up the
+# expected result against the dealer's exact final score distribution
+# (get_expected_counts) instead of growing dealer nodes card by card; hands
+# finished by a rollout_policy sample the dealer's score (settle_dealer)
+# max_nodes caps the size of the tree, evicting the least visited nodes
+# (see prune_tree) whenever the search grows it past the cap
+# rollout_policy, if given, plays out the rest of the hand once a rollout
+# reaches a node that hasn't been visited yet, instead of selecting by UCB
+# all the way down: "random", "threshold", "table" (see ROLLOUT_POLICIES)
+# or a function of a SearchState returning an action code
+# prior, if given, seeds new player decision nodes with virtual simulations:
+# "approximate" or a NodePrior (see NodePrior)
+# allowed, if given, limits the first action of every rollout to those
+# action codes ("Ph", "Ps", "Pd"), see run_racing_simulations
+# hole_counts, if given, deals the dealer's facedown card at the start of each
+# rollout to a game showing only the upcard: hole_counts[value] rollouts get
+# that card (see get_hole_counts), in a random order so every action sees the
+# cards in the same proportions whichever of them UCB favours; it replaces count
+def run_simulations(game, actions, action_history, count = 1000, progress = True, stats = None, table = None,
+                    exact_dealer = False, max_nodes = None, rollout_policy = None, prior = None, allowed = None,
+                    hole_counts = None):
+  rollout_policy = get_rollout_policy(rollout_policy)
+  prior = get_prior(prior, game)
+  if isinstance(action_history, NodeStore):
+    store = action_history
+  else:
+    # a dict tree is searched as a NodeStore and written back afterwards
+    store = NodeStore(actions)
+    merge_metrics(store, {a: (m.wins, m.draws, m.played) for a, m in action_history.items() if a.startswith(actions)})
+  if allowed is not None:
+    allowed = [ACTION_CODES.index(a) for a in allowed]
+  root = store.find(actions, create = True)
+  if root < 0:
+    raise ValueError(actions + ' is not in the search tree rooted at ' + store.root_actions)
+
+  if not isinstance(game, SearchState):
+    game = SearchState.from_game(game, doubled = "Pd" in actions)
+  first_action = actions == ""
+  nodes = len(store)
+
+  holes = None
+  if hole_counts is not None:
+    holes = {}
+    schedule = []
+    for value, n in enumerate(hole_counts):
+      if n > 0:
+        branch = holes[value] = game.clone()
+        branch.deck[value] -= 1
+        branch.d_total += value + 1
+        if value == 0:
+          branch.d_aces += 1
+        schedule.extend([value] * n)
+    for i in range(len(schedule) - 1, 0, -1):
+      j = game.deck.stream.randrange(i + 1)
+      schedule[i], schedule[j] = schedule[j], schedule[i]
+    count = len(schedule)
+  timer = time.perf_counter
+  evicted = 0
+
+  # skip the progress bar entirely when nobody is watching
+  iterations = tqdm(range(count), mininterval = 0.2) if progress else range(count)
+  for i in iterations:
+    node = root
+    path = [root]
+    table_path = []
+    state = game if holes is None else holes[schedule[i]]
+    result = get_score(state, actions)
+    counts = None
 
     while result is None:
-      child = select_action(game_path[-1], path[-1], action_history)
-      if child not in action_history:
-        action_history[child] = Metrics()
-      path.append(child)
-      #last two letters of action string are the next action to take
-      actionCode = child[-2:] 
-      
-      child_game = copy.deepcopy(game_path[-1])
-      child_game = make_move(child_game, actionCode)
+      if stats is not None:
+        t0 = timer()
+      node = select_child(state, store, node, first_action and node == root, table, table_path, prior,
+                          allowed if node == root else None)
+      path.append(node)
+      if stats is not None:
+        t1 = timer()
+      state = state.clone()
+      if stats is not None:
+        t2 = timer()
+      state = make_move(state, ACTION_CODES[store.action[node]])
+      if exact_dealer and state.turn == "Dealer":
+        # score the stand against every final score the dealer can reach
+        counts = get_expected_counts(state)
+      if stats is not None:
+        t3 = timer()
+      if counts is None:
+        # the state tracks the double down, so no action string is needed
+        result = get_score(state, "Pd" if state.doubled else "")
+      else:
+        result = counts[3]
+      if stats is not None:
+        t4 = timer()
+        stats.timings["select"] += t1 - t0
+        stats.timings["clone"] += t2 - t1
+        stats.timings["move"] += t3 - t2
+        stats.timings["score"] += t4 - t3
+      # past the tree frontier the rollout policy finishes the hand
+      if (result is None and rollout_policy is not None
+          and store.played[node] == get_prior_played(prior, store.action[node])):
+        result = play_out(state, rollout_policy, exact_dealer)
+        if stats is not None:
+          stats.timings["move"] += timer() - t4
+
+    if stats is not None:
+      t0 = timer()
+    if counts is None:
+      for n in path:
+        store.update(n, result)
+      for key, code in table_path:
+        table.update(key, code, result)
+    else:
+      wins, draws, played = counts[:3]
+      for n in path:
+        store.add(n, wins, draws, played)
+      for key, code in table_path:
+        table.add(key, code, wins, draws, played)
+    if stats is not None:
+      stats.timings["backup"] += timer() - t0
+      stats.rollouts += 1
+      stats.depth_total += len(path) - 1
+
+    # evict down to three quarters of the cap so pruning doesn't run every rollout
+    if max_nodes is not None and len(store) > max_nodes:
+      before = len(store)
+      root = store.prune(max_nodes * 3 // 4, root)
+      evicted += before - len(store)
+
+  if stats is not None:
+    stats.nodes_created += len(store) - nodes + evicted
+    stats.nodes_evicted += evicted
+
+  if store is not action_history:
+    for a in [a for a in action_history if a.startswith(actions)]:
+      del action_history[a]
+    for a, (wins, draws, played) in store.get_totals().items():
+      metrics = action_history[a] = Metrics()
+      metrics.add(wins, draws, played)
+
+# Body of one root-parallel worker: grow a private tree with its own
+# random stream and send back plain (wins, draws, played) totals per node.
+# search holds run_simulations' options.
+def run_worker_simulations(game, actions, count, seed, worker_aggression, search):
+  global aggression
+  aggression = worker_aggression
+  default_stream.seed(int(seed))
+  # the game arrives with a pickled copy of the parent's stream
+  game.deck.stream = default_stream
+
+  store = NodeStore(actions)
+  run_simulations(game, actions, store, count, progress = False, **search)
+  return store.get_totals()
+
+def get_worker_pool(workers):
+  global worker_pool, worker_pool_size
+  if worker_pool is None or worker_pool_size != workers:
+    if worker_pool is not None:
+      worker_pool.shutdown()
+    worker_pool = ProcessPoolExecutor(max_workers = workers)
+    worker_pool_size = workers
+  return worker_pool
+
+# shut down the shared process pool, if one was started
+def close_pool():
+  global worker_pool, worker_pool_size
+  if worker_pool is not None:
+    worker_pool.shutdown()
+    worker_pool = None
+    worker_pool_size = 0
+
+atexit.register(close_pool)
+
+# add per-node totals from another tree into action_history
+def merge_metrics(action_history, totals):
+  if isinstance(action_history, NodeStore):
+    for a, (wins, draws, played) in totals.items():
+      action_history.add(action_history.find(a, create = True), wins, draws, played)
+    return
+
+  for a, (wins, draws, played) in totals.items():
+    if a not in action_history:
+      action_history[a] = Metrics()
+    action_history[a].wins += wins
+    action_history[a].draws += draws
+    action_history[a].played += played
+
+# Root-parallel version of run_simulations: each of workers processes runs
+# count simulations on its own tree from the same root, and the Metrics of
+# every node are summed into action_history at the end.
+# workers defaults to one per core, seed makes the worker streams reproducible
+# and defaults to one drawn from the deck's stream, so seeding that is enough.
+# exact_dealer, max_nodes, rollout_policy, prior, allowed and hole_counts are
+# passed on to each worker's run_simulations, so a rollout_policy function
+# must be picklable; max_nodes also caps the merged tree. A TranspositionTable
+# can't be shared between processes.
+def run_parallel_simulations(game, actions, action_history, count = 1000, workers = None, seed = None,
+                             exact_dealer = False, max_nodes = None, rollout_policy = None, prior = None,
+                             allowed = None, hole_counts = None):
+  if workers is None:
+    workers = os.cpu_count() or 1
+  search = {"exact_dealer": exact_dealer, "max_nodes": max_nodes, "rollout_policy": rollout_policy,
+            "prior": get_prior(prior, game), "allowed": allowed, "hole_counts": hole_counts}
+
+  if not isinstance(game, SearchState):
+    game = SearchState.from_game(game, doubled = "Pd" in actions)
+
+  if seed is None:
+    seed = int(game.deck.stream.generator.integers(1 << 62))
+  seeds = [s.generate_state(1)[0] for s in np.random.SeedSequence(seed).spawn(workers)]
+  pool = get_worker_pool(workers)
+  results = pool.map(run_worker_simulations, [game] * workers, [actions] * workers,
+                     [count] * workers, seeds, [aggression] * workers, [search] * workers)
+
+  if actions not in action_history:
+    action_history[actions] = Metrics()
+  for totals in results:
+    merge_metrics(action_history, totals)
+  if max_nodes is not None:
+    prune_tree(action_history, max_nodes, actions)
+
+# Root-only alternative to run_simulations: every available root action is
+# evaluated with count vectorized rollouts (see blackjack_batch) and the
+# totals are added to that action's Metrics.
+def run_batch_simulations(game, actions, action_history, count = 1000, rng = None):
+  if actions not in action_history:
+    action_history[actions] = Metrics()
 
-      game_path.append(child_game)
-      result = get_score(game_path[-1], child)
+  if not isinstance(game, SearchState):
+    game = SearchState.from_game(game, doubled = "Pd" in actions)
 
-    for a in path:
-      action_history[a].update(result)
+  if rng is None:
+    rng = game.deck.stream.generator
+  for a in get_possible_actions(game, actions):
+    totals = blackjack_batch.get_totals(blackjack_batch.rollout(game, a[-2:], count, rng = rng))
+    merge_metrics(action_history, {a: totals, actions: totals})
 
 def make_move(game, actionCode):
   # player hit
@@ -189,6 +916,8 @@ def make_move(game, actionCode):
 
   # player double down
   elif actionCode == "Pd":
+    if isinstance(game, SearchState):
+      game.doubled = True
     game.player_draw()
     if game.score_p_hand() > 21:
       game.turn = 'End'
@@ -208,6 +937,41 @@ def make_move(game, actionCode):
 
   return game
 
+# final dealer scores in the order of a dealer distribution, 22 for a bust
+DEALER_SCORES = range(blackjack_exact.BUST + 1)
+
+# Finish the dealer's turn of a SearchState in one step: their final score is
+# sampled from the exact distribution (see blackjack_exact.dealer_distribution)
+# instead of drawn card by card.
+def settle_dealer(state):
+  probs = blackjack_exact.get_dealer_distribution(state)
+  state.d_total = DEALER_SCORES[state.deck.stream.pick(probs)]
+  state.d_aces = 0
+  state.turn = "End"
+  return state
+
+# What Metrics.update adds on average when the player's hand in a SearchState
+# on the dealer's turn is scored against the dealer's exact final score
+# distribution (blackjack_exact.get_dealer_distribution), instead of against
+# one score sampled from it like settle_dealer does.
+# Returns (wins, draws, played, expected result).
+def get_expected_counts(state):
+  p_score = state.score_p_hand()
+  probs = blackjack_exact.get_dealer_distribution(state)
+  win = 0.0
+  draw = 0.0
+  for score, p in enumerate(probs):
+    if p > 0:
+      outcome = blackjack_exact.compare_scores(p_score, score)
+      if outcome > 0:
+        win += p
+      elif outcome == 0:
+        draw += p
+  loss = 1.0 - win - draw
+  stake = 2 if state.doubled else 1
+  # a doubled draw is still played once, see Metrics.update
+  return stake * win, draw, stake * (win + loss) + draw, stake * blackjack_exact.distribution_ev(probs, p_score)
+
 def update_balance(game, actions, bet):
   dd_modifier = 1
   if game.turn == "End":
@@ -235,35 +999,544 @@ def action_to_text(actions):
     message = message + "double down"
   return message
 
-def reccomend_action(game, actions):
-  # create a game that doesn't know the real facedown card
-  # the dealer will automatically draw an extra card at the beginning of 
-  # its turn to compensate
-  temp_game = copy.deepcopy(game)
+# engine selects how the reccomendation is computed:
+#   "mcts"  - monte carlo tree search over sampled rollouts
+#   "exact" - exact expected value of each action, see blackjack_exact
+#   "batch" - vectorized rollouts of each root action, see blackjack_batch
+#   "paired" - every root action on the same card orders, see run_paired_comparison
+
+# Re-root a search tree on the action path the hand actually took.
+# Nodes off that path can never be visited again and are dropped. The nodes
+# that stay were gathered over every card the player might have drawn, not
+# the one they did draw, so their statistics are scaled by keep and act as a
+# prior that fresh rollouts from the real position quickly outweigh.
+# Nodes left with less than one simulation are dropped as well.
+def reroot_tree(action_history, actions, keep = 0.5):
+  if isinstance(action_history, NodeStore):
+    action_history.reroot(actions, keep)
+    return
+
+  for a in list(action_history):
+    if not a.startswith(actions) or action_history[a].played * keep < 1:
+      del action_history[a]
+    else:
+      metrics = action_history[a]
+      metrics.wins *= keep
+      metrics.draws *= keep
+      metrics.played *= keep
+
+# Cap a search tree at max_nodes by evicting its least visited nodes, see
+# NodeStore.prune. The action history keep and everything above it is never
+# evicted, nor are the statistics of the nodes that stay touched.
+def prune_tree(action_history, max_nodes, keep = ""):
+  if isinstance(action_history, NodeStore):
+    action_history.prune(max_nodes, max(0, action_history.find(keep)))
+    return
+  if len(action_history) <= max_nodes:
+    return
+
+  path = {keep[:i] for i in range(0, len(keep) + 1, 2)}
+  # parents have been played at least as often as their children, so they come first
+  ranked = sorted(action_history, key = lambda a: (a not in path, -action_history[a].played, len(a)))
+  kept = set()
+  for a in ranked:
+    if len(kept) >= max_nodes and a not in path:
+      break
+    if a in path or a[:-2] in kept or a[:-2] not in action_history:
+      kept.add(a)
+  for a in list(action_history):
+    if a not in kept:
+      del action_history[a]
+
+# bytes taken by one node of a search tree, for turning a memory cap into max_nodes
+def get_node_bytes(action_history):
+  if isinstance(action_history, NodeStore):
+    return get_tree_memory(action_history) // len(action_history)
+  return max(1, get_tree_memory(action_history) // max(1, len(action_history)))
+
+# run count simulations with the selected engine
+# stats only gets phase timings from the in-process mcts engine, the other
+# engines just add their rollouts and overall search time
+# table, exact_dealer, max_nodes, rollout_policy, prior, allowed and
+# hole_counts are used by the mcts engine, the parallel one takes all but table
+def run_search(game, actions, action_history, count, engine = "mcts", workers = 1, progress = True, stats = None,
+               table = None, exact_dealer = False, max_nodes = None, rollout_policy = None, prior = None,
+               allowed = None, hole_counts = None):
+  if stats is not None:
+    start = time.perf_counter()
+
+  if engine == "batch":
+    run_batch_simulations(game, actions, action_history, count)
+  elif workers > 1:
+    run_parallel_simulations(game, actions, action_history, count, workers = workers, exact_dealer = exact_dealer,
+                             max_nodes = max_nodes, rollout_policy = rollout_policy, prior = prior,
+                             allowed = allowed, hole_counts = hole_counts)
+  else:
+    run_simulations(game, actions, action_history, count, progress, stats, table, exact_dealer, max_nodes,
+                    rollout_policy, prior, allowed, hole_counts)
+
+  if stats is not None:
+    stats.timings["search"] += time.perf_counter() - start
+    if engine == "batch" or workers > 1:
+      stats.rollouts += count * (workers if engine != "batch" else len(get_possible_actions(game, actions)))
+
+# Split count rollouts between the possible facedown cards in proportion to
+# how many of each are left in the deck. The play only reaches a decision if
+# the dealer didn't have blackjack, so the card that would complete it is left
+# out. Shares are rounded by systematic sampling with a random offset, so every
+# card gets its share rounded up or down and the split is unbiased.
+def get_hole_counts(game, count):
+  peek = blackjack_exact.get_peek(game.d_hand.hard, game.d_hand.aces > 0)
+  weights = [0 if value == peek else n for value, n in enumerate(game.deck)]
+  total = sum(weights)
+  counts = [0] * len(weights)
+  if total == 0:
+    return counts
+
+  offset = game.deck.stream.random()
+  cumulative = 0
+  for value, w in enumerate(weights):
+    before = math.ceil(cumulative * count / total - offset)
+    cumulative += w
+    counts[value] = math.ceil(cumulative * count / total - offset) - before
+  return counts
+
+# run_search stratified over the dealer's facedown card: game is the dealer
+# with only their upcard, and each possible facedown card gets its share of
+# count (see get_hole_counts). The mcts engine deals them to its rollouts in
+# a random order (see run_simulations' hole_counts); the batch engine gives
+# every action the same rollouts, so it searches each card in turn.
+def run_hole_search(game, actions, action_history, count, engine = "mcts", workers = 1, stats = None,
+                    table = None, exact_dealer = False, max_nodes = None, rollout_policy = None, prior = None,
+                    allowed = None, progress = False):
+  # one prior for every card, from the deck the player sees
+  prior = get_prior(prior, game)
+  counts = get_hole_counts(game, count)
+  if sum(counts) == 0:
+    run_search(game, actions, action_history, count, engine, workers, progress, stats, table, exact_dealer,
+               max_nodes, rollout_policy, prior, allowed)
+  elif engine != "batch":
+    run_search(game, actions, action_history, sum(counts), engine, workers, progress, stats, table, exact_dealer,
+               max_nodes, rollout_policy, prior, allowed, counts)
+  else:
+    state = SearchState.from_game(game, doubled = "Pd" in actions)
+    for value, n in enumerate(counts):
+      if n == 0:
+        continue
+      branch = state.clone()
+      branch.deck[value] -= 1
+      branch.d_total += value + 1
+      if value == 0:
+        branch.d_aces += 1
+      run_search(branch, actions, action_history, n, engine, workers, False, stats, table, exact_dealer,
+                 max_nodes, rollout_policy, prior, allowed)
+
+# Paired comparison of the root actions: all of them are played out against
+# the same count card orders drawn from game's deck (blackjack_batch.compare_actions),
+# so the noise from the cards cancels out of the differences between them.
+# Returns the best action code, its mean result, and its advantage over the
+# runner-up with that advantage's standard error, all in units of the bet.
+def run_paired_comparison(game, actions, count = 1000, rng = None):
+  state = SearchState.from_game(game, doubled = "Pd" in actions)
+  codes = [a[-2:] for a in get_possible_actions(state, actions)]
+  if rng is None:
+    rng = state.deck.stream.generator
+  results = blackjack_batch.compare_actions(state, codes, count, rng = rng, hole = len(game.d_hand) < 2)
+
+  means = {code: float(np.mean(r)) for code, r in results.items()}
+  ranked = sorted(codes, key = means.get, reverse = True)
+  diffs = results[ranked[0]] - results[ranked[1]]
+  error = float(np.std(diffs, ddof = 1) / len(diffs) ** .5) if len(diffs) > 1 else float('inf')
+  return ranked[0], means[ranked[0]], float(np.mean(diffs)), error
+
+# true when the best action's confidence interval lies entirely above the
+# runner-up's, so more simulations are unlikely to change the reccomendation
+def actions_separated(action_history, possible_actions, z, min_played = 30):
+  if len(possible_actions) < 2:
+    return True
+  metrics = [action_history[a] if a in action_history else Metrics() for a in possible_actions]
+  if min(m.played for m in metrics) < min_played:
+    return False
+  ranked = sorted(metrics, key = lambda m: m.get_win_percentage(), reverse = True)
+  return ranked[0].get_confidence_interval(z)[0] > ranked[1].get_confidence_interval(z)[1]
+
+# Anytime search: run simulations in chunks until the best root action
+# separates from the runner-up at the given confidence (e.g. 0.95), the
+# deadline in milliseconds passes, or max_count simulations have run.
+# Returns the number of simulations run.
+def run_anytime_simulations(game, actions, action_history, deadline_ms = None, confidence = None,
+                            engine = "mcts", workers = 1, chunk = 50, max_count = 100000, stats = None,
+                            table = None, exact_dealer = False, stratify_hole = False, max_nodes = None,
+                            rollout_policy = None, prior = None):
+  start = time.perf_counter()
+  z = None
+  if confidence is not None:
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+  possible_actions = get_possible_actions(game, actions)
+  prior = get_prior(prior, game)
+
+  run = 0
+  while run < max_count:
+    if stratify_hole:
+      run_hole_search(game, actions, action_history, chunk, engine, workers, stats, table, exact_dealer, max_nodes,
+                      rollout_policy, prior)
+    else:
+      run_search(game, actions, action_history, chunk, engine, workers, progress = False, stats = stats,
+                 table = table, exact_dealer = exact_dealer, max_nodes = max_nodes, rollout_policy = rollout_policy,
+                 prior = prior)
+    run += chunk
+    if z is not None and actions_separated(action_history, possible_actions, z):
+      break
+    if deadline_ms is not None and (time.perf_counter() - start) * 1000 >= deadline_ms:
+      break
+  return run
+
+# root actions whose confidence interval still overlaps the leader's, best first;
+# actions with fewer than min_played simulations always stay in contention
+def get_contenders(action_history, possible_actions, z, min_played = 30):
+  metrics = {a: action_history[a] if a in action_history else Metrics() for a in possible_actions}
+  ranked = sorted(possible_actions, key = lambda a: metrics[a].get_win_percentage(), reverse = True)
+  leader = metrics[ranked[0]]
+  if leader.played < min_played:
+    return ranked
+  low = leader.get_confidence_interval(z)[0]
+  return [a for a in ranked if metrics[a].played < min_played or metrics[a].get_confidence_interval(z)[1] >= low]
+
+# Racing allocation of count simulations at the root: they run in rounds of
+# chunk, split evenly between the root actions still in contention (see
+# get_contenders), so actions that have clearly lost stop taking a share of
+# the budget as they would under UCB-proportional selection. The search stops
+# early once only one action is left or the deadline in milliseconds passes.
+# Returns the actions still in contention and the number of simulations run.
+def run_racing_simulations(game, actions, action_history, count = 1000, confidence = 0.95, chunk = 60,
+                           deadline_ms = None, stats = None, table = None, exact_dealer = False,
+                           stratify_hole = False, max_nodes = None, rollout_policy = None, prior = None):
+  start = time.perf_counter()
+  z = NormalDist().inv_cdf((1 + confidence) / 2)
+  prior = get_prior(prior, game)
+  contenders = get_possible_actions(game, actions)
+
+  run = 0
+  while run < count and len(contenders) > 1:
+    share = max(1, min(chunk, count - run) // len(contenders))
+    for a in contenders:
+      if stratify_hole:
+        run_hole_search(game, actions, action_history, share, "mcts", 1, stats, table, exact_dealer, max_nodes,
+                        rollout_policy, prior, (a[-2:],))
+      else:
+        run_search(game, actions, action_history, share, "mcts", 1, False, stats, table, exact_dealer, max_nodes,
+                   rollout_policy, prior, (a[-2:],))
+      run += share
+    contenders = get_contenders(action_history, contenders, z)
+    if deadline_ms is not None and (time.perf_counter() - start) * 1000 >= deadline_ms:
+      break
+  return contenders, run
+
+# create a game that doesn't know the real facedown card
+# the dealer will automatically draw an extra card at the beginning of 
+# its turn to compensate
+def hide_hole_card(game):
+  temp_game = Game(deck = game.deck.copy(), p_hand = list(game.p_hand), d_hand = list(game.d_hand),
+                   budget = game.budget, winnings = game.winnings, d_stay = game.d_stay,
+                   turn = game.turn, sink = NullSink())
   dealer_facedown = temp_game.d_hand[-1]   # check facedown card
   temp_game.deck[dealer_facedown] += 1     # add facedown back to deck
   temp_game.d_hand = temp_game.d_hand[:-1] # remove facedown card from hand
-
-  action_history = {}
+  return temp_game
+
+# workers > 1 runs the mcts search root-parallel on that many processes
+# passing an action_history keeps the search tree between calls: with the mcts
+# engine a tree that already holds statistics for this position is topped up
+# to count visits (with at least a tenth of count new simulations) instead of
+# rebuilt
+# deadline_ms and/or confidence switch to an anytime search that stops early
+# once the best action is clear, see run_anytime_simulations
+# stats, if given, is a SearchStats filled in by the search and then sent to
+# the game's sink as a "search_stats" event
+# table, if given, is a TranspositionTable that can be kept across decisions
+# exact_dealer samples the dealer's final score instead of playing it out
+# stratify_hole splits the mcts and batch rollouts over every possible
+# facedown card (run_hole_search) instead of letting each rollout draw one
+# max_bytes caps the memory held by the search tree (see prune_tree); with
+# stats the tree's node count and bytes are reported after the search
+# rollout_policy plays out hands below the tree frontier and prior seeds new
+# decision nodes, see run_simulations
+# allocation "racing" spends count on the root actions still in contention
+# (run_racing_simulations, at confidence or 0.95) instead of the default "ucb"
+def reccomend_action(game, actions, engine = "mcts", workers = 1, action_history = None, count = 1000,
+                     deadline_ms = None, confidence = None, stats = None, table = None, exact_dealer = False,
+                     stratify_hole = False, max_bytes = None, rollout_policy = None, prior = None,
+                     allocation = "ucb"):
+  temp_game = hide_hole_card(game)
+  # search on a stream of its own, so the cards dealt afterwards don't depend
+  # on how many simulations it took
+  temp_game.deck.stream = default_stream.spawn()
+
+  if engine == "exact":
+    action, value = blackjack_exact.best_action(temp_game, actions)
+    game.sink.emit("recommendation", game, action = action, value = value,
+                   text = action_to_text(action) + " (expected value {:+.3f}x bet)".format(value))
+    return action
+  elif engine == "paired":
+    action, value, advantage, error = run_paired_comparison(temp_game, actions, count)
+    game.sink.emit("recommendation", game, action = action, value = value, advantage = advantage, error = error,
+                   text = action_to_text(action) + " ({:+.3f}x bet over the next best, standard error {:.3f})".format(
+                     advantage, error))
+    return action
+  elif engine != "mcts" and engine != "batch":
+    raise ValueError(engine + ' is not a valid engine.')
+  if allocation != "ucb" and (allocation != "racing" or engine != "mcts" or workers > 1):
+    raise ValueError(allocation + ' is not a valid allocation for the ' + engine + ' engine.')
+  if table is not None and engine == "mcts" and workers > 1:
+    raise ValueError('A transposition table can not be shared between worker processes.')
+
+  if action_history is None:
+    action_history = NodeStore(actions)
 
   if actions not in action_history:
     action_history[actions] = Metrics()
 
-  run_simulations(temp_game, actions, action_history)
+  # built once from the deck the player sees, not per hole card branch
+  prior = get_prior(prior, temp_game)
+
+  max_nodes = None
+  if max_bytes is not None:
+    max_nodes = max(2, max_bytes // get_node_bytes(action_history))
+    prune_tree(action_history, max_nodes, actions)
+
   possible_actions = get_possible_actions(temp_game, actions)
+  if allocation == "racing":
+    count = max(count // 10, count - int(action_history[actions].played))
+    possible_actions, run = run_racing_simulations(temp_game, actions, action_history, count, confidence or 0.95,
+                                                   deadline_ms = deadline_ms, stats = stats, table = table,
+                                                   exact_dealer = exact_dealer, stratify_hole = stratify_hole,
+                                                   max_nodes = max_nodes, rollout_policy = rollout_policy,
+                                                   prior = prior)
+  elif deadline_ms is not None or confidence is not None:
+    run_anytime_simulations(temp_game, actions, action_history, deadline_ms, confidence, engine, workers,
+                            stats = stats, table = table, exact_dealer = exact_dealer, stratify_hole = stratify_hole,
+                            max_nodes = max_nodes, rollout_policy = rollout_policy, prior = prior)
+  else:
+    # only the mcts engine grows a tree below the root worth topping up
+    if engine == "mcts":
+      count = max(count // 10, count - int(action_history[actions].played))
+    if stratify_hole:
+      run_hole_search(temp_game, actions, action_history, count, engine, workers, stats, table, exact_dealer,
+                      max_nodes, rollout_policy, prior, progress = game.sink.progress)
+    else:
+      run_search(temp_game, actions, action_history, count, engine, workers, game.sink.progress, stats, table,
+                 exact_dealer, max_nodes, rollout_policy, prior)
+
+  if stats is not None:
+    stats.tree_nodes = len(action_history)
+    stats.tree_bytes = get_tree_memory(action_history)
+    game.sink.emit("search_stats", game, stats = stats)
   values = [action_history[a].get_win_percentage() for a in possible_actions]
+  action = str(possible_actions[np.argmax(values)])[-2:]
 
-  print(action_to_text(str(possible_actions[np.argmax(values)])) + 
-                          " ({:.1f}% confidence)".format(np.max(values)*100))
+  game.sink.emit("recommendation", game, action = action, value = np.max(values),
+                 text = action_to_text(action) + " ({:.1f}% confidence)".format(np.max(values)*100))
   
-  return str(possible_actions[np.argmax(values)])[-2:]
-
-def play(game, bet = None, reccs = True, auto = False):
+  return action
+
+# Canonical form of a reccomendation query: what reccomend_action can see.
+# The facedown card goes back into the deck, and the player's hand is reduced
+# to its hard total and whether it holds an ace, so 10 5 and 5 10 (or 7 8)
+# against the same upcard and deck are the same query. A game from
+# hide_hole_card already has it back in the deck.
+def get_state_key(game, actions):
+  deck = list(game.deck)
+  if len(game.d_hand) > 1:
+    deck[game.d_hand[-1]] += 1
+  return (tuple(deck), game.p_hand.hard, game.p_hand.aces > 0, game.d_hand[0], game.d_stay,
+          actions == "")
+
+# Size-bounded LRU cache of reccomended actions keyed by get_state_key.
+class RecommendationCache:
+  def __init__(self, maxsize = 4096):
+    self.entries = OrderedDict()
+    self.maxsize = maxsize
+    self.hits = 0
+    self.misses = 0
+
+  def __len__(self):
+    return len(self.entries)
+
+  def __contains__(self, key):
+    return key in self.entries
+
+  # the cached action for key, or None; counts a hit or a miss
+  def get(self, key):
+    action = self.entries.get(key)
+    if action is None:
+      self.misses += 1
+      return None
+    self.entries.move_to_end(key)
+    self.hits += 1
+    return action
+
+  def put(self, key, action):
+    self.entries[key] = action
+    self.entries.move_to_end(key)
+    if len(self.entries) > self.maxsize:
+      self.entries.popitem(last = False)
+
+# cache shared by recommend_many calls that don't bring their own
+recommendation_cache = RecommendationCache()
+
+# Reccomend actions for many (game, actions) queries at once. Queries are
+# canonicalized with get_state_key: repeats are served from cache (repeats
+# within the batch count as hits too) and each distinct miss is searched once
+# with reccomend_action(**search) on a fresh tree. Cache entries are only
+# shared between calls that pass the same search settings.
+# Returns the reccomended action codes in the order of states.
+def recommend_many(states, cache = None, **search):
+  if cache is None:
+    cache = recommendation_cache
+  settings = tuple(sorted(search.items()))
+
+  # this batch's answers, the cache may evict some of them before the end
+  answers = {}
+  keys = []
+  pending = {}
+  for game, actions in states:
+    key = (get_state_key(game, actions), settings)
+    keys.append(key)
+    if key in pending or key in answers:
+      cache.hits += 1
+      continue
+    action = cache.get(key)
+    if action is None:
+      pending[key] = (game, actions)
+    else:
+      answers[key] = action
+
+  for key, (game, actions) in pending.items():
+    answers[key] = reccomend_action(game, actions, **search)
+    cache.put(key, answers[key])
+  return [answers[key] for key in keys]
+
+# Speculative search on a background thread while the player is deciding.
+# start() hides the dealer's facedown card like reccomend_action and keeps
+# adding chunks of stratified simulations (run_hole_search) to action_history
+# until stop(), which hands the warmed tree back: a reccomend_action on the
+# same tree afterwards only tops it up. start_hit() and start_deals() search
+# positions that depend on a card still to be drawn (the player's next card,
+# or the whole next deal): every chunk draws one and searches the position it
+# leads to in a tree of its own in trees, keyed by get_state_key, so only the
+# tree for the card that actually comes is used afterwards.
+# The thread draws from a stream spawned from default_stream, so it doesn't
+# change the cards dealt to the real game however long it runs.
+# Waiting on input releases the interpreter lock, so the thread gets the idle
+# time. action_history must not be used between start() and stop().
+class SpeculativeSearch:
+  def __init__(self, chunk = 50, max_count = 20000):
+    self.chunk = chunk
+    self.max_count = max_count
+    self.thread = None
+    self.stopping = threading.Event()
+    self.count = 0
+    self.error = None
+    self.trees = {}
+
+  def start_thread(self, target, *args):
+    self.stop()
+    self.stopping.clear()
+    self.count = 0
+    self.thread = threading.Thread(target = target, args = args, daemon = True)
+    self.thread.start()
+
+  # a copy of game without the facedown card, drawing from a stream of its own
+  def get_search_game(self, game):
+    game = hide_hole_card(game)
+    game.deck.stream = default_stream.spawn()
+    return game
+
+  def start(self, game, actions, action_history):
+    self.start_thread(self.run, self.get_search_game(game), actions, action_history)
+
+  def run(self, game, actions, action_history):
+    try:
+      while not self.stopping.is_set() and self.count < self.max_count:
+        run_hole_search(game, actions, action_history, self.chunk)
+        self.count += self.chunk
+    except Exception as e:
+      self.error = e
+
+  # search the positions after the player hits, one tree per card drawn
+  def start_hit(self, game, actions):
+    self.trees = {}
+    self.start_thread(self.run_hit, self.get_search_game(game), actions + "Ph")
+
+  def run_hit(self, game, actions):
+    try:
+      while not self.stopping.is_set() and self.count < self.max_count:
+        branch = Game(deck = game.deck.copy(), p_hand = list(game.p_hand), d_hand = list(game.d_hand),
+                      d_stay = game.d_stay, turn = game.turn, sink = NullSink())
+        make_move(branch, "Ph")
+        if branch.turn != "Player":
+          # a bust ends the hand, there's nothing to search
+          self.count += 1
+          continue
+        tree = self.trees.setdefault(get_state_key(branch, actions), NodeStore(actions))
+        run_hole_search(branch, actions, tree, self.chunk)
+        self.count += self.chunk
+    except Exception as e:
+      self.error = e
+
+  # before the next hand is dealt, search random deals from game.deck, growing
+  # one tree per distinct opening, so the likeliest openings collect the most
+  # simulations
+  def start_deals(self, game):
+    self.trees = {}
+    deck = game.deck.copy()
+    deck.stream = default_stream.spawn()
+    self.start_thread(self.run_deals, deck, game.d_stay)
+
+  def run_deals(self, deck, d_stay):
+    try:
+      while not self.stopping.is_set() and self.count < self.max_count:
+        deal = Game(deck = deck.copy(), d_stay = d_stay, sink = NullSink())
+        deal.p_hand = []
+        deal.d_hand = []
+        deal.player_draw()
+        deal.player_draw()
+        deal.dealer_draw()
+        deal.dealer_draw()
+        # play() settles these without asking for a reccomendation
+        if deal.p_hand.is_blackjack or deal.d_hand.is_blackjack:
+          continue
+        tree = self.trees.setdefault(get_state_key(deal, ""), NodeStore())
+        run_hole_search(hide_hole_card(deal), "", tree, self.chunk)
+        self.count += self.chunk
+    except Exception as e:
+      self.error = e
+
+  # wait for the thread to finish its chunk, returns how many simulations it ran
+  def stop(self):
+    if self.thread is not None:
+      self.stopping.set()
+      self.thread.join()
+      self.thread = None
+      if self.error is not None:
+        error, self.error = self.error, None
+        raise error
+    return self.count
+
+# reuse_tree keeps the search tree across the player's decisions in this hand
+# policy, if given, replaces reccomend_action: it is called as policy(game, actions)
+# and returns "Ph", "Ps" or "Pd". It must not look at the dealer's facedown card.
+# speculate searches in the background while waiting for the player to choose
+# a bet or an action (see SpeculativeSearch), for the in-process mcts engine
+# trees, if given, holds trees grown for possible openings before the deal
+# (SpeculativeSearch.start_deals); the one for the dealt opening is topped up
+def play(game, bet = None, reccs = True, auto = False, engine = "mcts", workers = 1, reuse_tree = True, policy = None,
+         speculate = True, trees = None):
   if reccs == False:
     game.play(bet)
   else:
     actions = ""
-    action_history = {}
+    action_history = NodeStore()
     can_double_down = False
     doubled_down = 1
     game.p_hand = []
@@ -272,47 +1545,63 @@ def play(game, bet = None, reccs = True, auto = False):
     game.player_draw()
     game.dealer_draw()
     game.dealer_draw()
+    game.sink.emit("deal", game)
+
+    if trees is not None and reuse_tree and engine == "mcts":
+      action_history = trees.get(get_state_key(game, actions), action_history)
 
     # on first move selection, if player hand is worth 9, 10, or 11 they may double down
     if game.score_p_hand() >= 9 and game.score_p_hand() <= 11:
       can_double_down = True
 
+    speculation = None
+    if speculate and policy is None and engine == "mcts" and workers == 1:
+      speculation = SpeculativeSearch()
+
     if bet is None:
-      print("Available Funds: ${0:.2f}\nEnter Bet Amount: ".format(game.budget + game.winnings))
-      bet = float(input())
-      while bet > game.budget + game.winnings:
-        print("You can not bet more than the amount of money you have.\nAvailable Funds: ${}\nEnter Bet Amount: ".format(game.budget + game.winnings))
-        bet = float(input())
+      # the opening decision is already known while the bet is chosen
+      if speculation is not None:
+        speculation.start(game, actions, action_history)
+      bet = game.sink.ask_bet(game)
+      if speculation is not None:
+        speculation.stop()
 
     if bet > game.budget + game.winnings:
       raise ValueError("You can not bet more than the amount of money you have. \nAttempted Bet: {}\nAvailable Funds: {}".format(bet, game.budget + game.winnings))
 
     #if first two cards are 21, player automatically wins 1.5x bet instead of 2x
-    if game.score_p_hand() == 21:
+    if game.p_hand.is_blackjack:
       game.turn = "End"
-      game.print_hands()
-      if game.score_d_hand() != 21:
-        print("Blackjack! You win 1.5x your bet!")
+      game.sink.emit("hands", game)
+      if not game.d_hand.is_blackjack:
         game.winnings += bet * 1.5
+        game.sink.emit("result", game, outcome = "blackjack", amount = bet * 1.5)
       else:
-        print("Stand-off: Your bet has been returned.")
+        game.sink.emit("result", game, outcome = "standoff", amount = 0.0)
       game.turn = "Player"
       return
     #if dealer has 21 on first hand and player doesn't, dealer wins
-    elif game.score_d_hand() == 21:
+    elif game.d_hand.is_blackjack:
       game.turn = "End"
-      game.print_hands()
-      print("Dealer Blackjack. You Lose.")
+      game.sink.emit("hands", game)
       game.winnings -= bet
+      game.sink.emit("result", game, outcome = "dealer blackjack", amount = -bet)
       game.turn = "Player"
       return
 
-    while game.turn is not "End":
-      game.print_hands()
+    while game.turn != "End":
+      game.sink.emit("hands", game)
 
       if game.turn == "Player":
-        print("Running simulations...")
-        sim_result = reccomend_action(game, actions)
+        if policy is not None:
+          sim_result = policy(game, actions)
+        else:
+          game.sink.emit("searching", game)
+          # the batch engine only fills in the root's children, so it has no subtree to reuse
+          if not reuse_tree or engine != "mcts":
+            action_history = NodeStore(actions)
+          sim_result = reccomend_action(game, actions, engine = engine, workers = workers,
+                                        action_history = action_history)
         if auto:
           if sim_result == "Ph":
             action = 1
@@ -321,79 +1610,82 @@ def play(game, bet = None, reccs = True, auto = False):
           elif sim_result == "Pd":
             action = 3
         else:
-          if can_double_down:
-            print("\n\nSelect an action:\n1) Hit\n2) Stay\n3) Double Down")
-            action = int(input())
-            while action < 1 or action > 3:
-              print("\n\nSelect an action:\n1) Hit\n2) Stay\n3) Double Down")
-              action = int(input())
-
-          else:
-            print("\n\nSelect an action:\n1) Hit\n2) Stay")
-            action = int(input())
-            while action < 1 or action > 2:
-              print("\n\nSelect an action:\n1) Hit\n2) Stay")
-              action = int(input())
+          # search the positions after a hit while the player decides
+          if speculation is not None and reuse_tree:
+            speculation.start_hit(game, actions)
+          action = game.sink.ask_action(game, can_double_down)
+          if speculation is not None:
+            speculation.stop()
 
         can_double_down = False
 
         #~~~~~~~~~~~~~ Hit ~~~~~~~~~~~~~
         if action == 1: 
           actions = actions + "Ph"
+          game.sink.emit("action", game, action = "Ph")
           game.player_draw()
-          if game.score_p_hand() > 21:
+          if game.p_hand.is_bust:
             game.turn = 'End'
+          elif speculation is not None and speculation.trees:
+            # speculation searched the card that came in a tree of its own
+            action_history = speculation.trees.get(get_state_key(game, actions), NodeStore(actions))
+          else:
+            reroot_tree(action_history, actions)
 
         #~~~~~~~~~~~~~ Stay ~~~~~~~~~~~~~
         elif action == 2:
           actions = actions + "Ps"
+          game.sink.emit("action", game, action = "Ps")
           game.turn = 'Dealer'
 
         #~~~~~~~~~~~~~ Double Down ~~~~~~~~~~~~~
         elif action == 3:
           actions = actions + "Pd"
+          game.sink.emit("action", game, action = "Pd")
           doubled_down = 2
           game.player_draw()
-          if game.score_p_hand() > 21:
+          if game.p_hand.is_bust:
             game.turn = 'End'
           else:
             game.turn = 'Dealer'
 
       elif game.turn == "Dealer":
         # Hit if not bust yet, hand value is less than player's, and dealer stay rule has not been reached
-        if game.score_d_hand() < game.d_stay and game.score_d_hand() <= game.score_p_hand() and game.score_d_hand() < 21:
+        d_score = game.d_hand.value
+        if d_score < game.d_stay and d_score <= game.p_hand.value and d_score < 21:
           actions = actions + "Dh"
-          print("~~~~~~~~ Dealer Hits ~~~~~~~~")
+          game.sink.emit("dealer_hit", game)
           game.dealer_draw()
         # else stay
         else:
           actions = actions + "Ds"
-          print("~~~~~~~~ Dealer Stays ~~~~~~~~")
+          game.sink.emit("dealer_stay", game)
           game.turn = 'End'
 
       # Failsafe for invalid turn state: Just end the game
       else:
-        print("Invalid Turn State: Game Ending")
+        game.sink.emit("invalid_turn", game)
         game.turn = 'End'
 
     #Hand has ended: Evaluate Result
-    print("\nEnd State Reached")
-    game.print_hands()
-    print("   Dealer Score: {}\n   Player Score: {}".format(game.score_d_hand(), game.score_p_hand()))
+    game.sink.emit("end", game)
+
+    p_score = game.p_hand.value
+    d_score = game.d_hand.value
 
     # Player Loss Condition
-    if game.score_p_hand() > 21 or (game.score_p_hand() < game.score_d_hand() and game.score_d_hand() <= 21):
-      print("You Lose")
+    if p_score > 21 or (p_score < d_score and d_score <= 21):
       game.winnings -= bet * doubled_down
+      game.sink.emit("result", game, outcome = "lose", amount = -bet * doubled_down)
 
     # Draw Condition
-    elif game.score_p_hand() == game.score_d_hand():
-      print("Draw")
+    elif p_score == d_score:
+      game.sink.emit("result", game, outcome = "draw", amount = 0.0)
 
     # Player Win Condition
-    elif game.score_p_hand() > game.score_d_hand() or game.score_d_hand() > 21:
-      print("You Win")
+    elif p_score > d_score or d_score > 21:
       game.winnings += bet * doubled_down
+      game.sink.emit("result", game, outcome = "win", amount = bet * doubled_down)
 
     game.turn = "Player"
 
@@ -408,10 +1700,706 @@ def evaluate_deck(deck, numdecks):
   value = value / float(max(1, numdecks))
   return value
 
+# bet sizing from the true count: the minimum bet plus half a unit per point
+# above the cutoff, capped at maxBet and at the funds available
+def reccomend_bet(deck_score, minBet, maxBet, funds, cutoffScore):
+  return max(min(minBet, funds), min(maxBet, minBet + ((deck_score - cutoffScore) / 2.0)))
+
 def make_n_decks(n):
   deck1 = [4, 4, 4, 4, 4, 4, 4, 4, 4, 16]
   return list(map(lambda val: val * n, deck1))
 
+class TestSearchState(unittest.TestCase):
+
+  def test_from_game_scores(self):
+    for hand in ([0, 9], [0, 0, 8], [0, 0, 0, 0], [5, 9], [0, 5, 9]):
+      game = Game(p_hand = list(hand), d_hand = list(hand), sink = NullSink())
+      state = SearchState.from_game(game)
+      self.assertEqual(game.score_p_hand(), state.score_p_hand())
+      self.assertEqual(game.score_d_hand(), state.score_d_hand())
+
+  def test_clone_is_independent(self):
+    state = SearchState(p_total = 5)
+    child = state.clone()
+    child.player_draw()
+    self.assertEqual(5, state.p_total)
+    self.assertEqual(52, sum(state.deck))
+    self.assertEqual(51, sum(child.deck))
+
+  def test_make_move(self):
+    state = SearchState(deck = [0,0,0,0,0,0,0,0,0,1], p_total = 12, d_total = 10, d_stay = 17)
+    make_move(state, "Ph")
+    self.assertEqual(22, state.score_p_hand())
+    self.assertEqual("End", state.turn)
+    self.assertEqual(-1, get_score(state, "Ph"))
+
+    state = SearchState(deck = [1,0,0,0,0,0,0,0,0,0], p_total = 10, d_total = 10, d_stay = 17)
+    make_move(state, "Pd")
+    self.assertTrue(state.doubled)
+    self.assertEqual(21, state.score_p_hand())
+    self.assertEqual("Dealer", state.turn)
+
+class TestExactEngine(unittest.TestCase):
+
+  def test_forced_outcomes(self):
+    # only tens left: hitting 12 always busts, dealer 10 + 10 stays on 20
+    game = Game(deck = [0,0,0,0,0,0,0,0,0,8], p_hand = [5, 5], d_hand = [9], d_stay = 17, sink = NullSink())
+    values = blackjack_exact.get_action_values(game, "Ph")
+    self.assertEqual(-1, values["Ph"])
+    self.assertEqual(-1, values["Ps"])
+    self.assertNotIn("Pd", values)
+
+    game = Game(deck = [0,0,0,0,0,0,0,0,0,8], p_hand = [9, 9], d_hand = [9], d_stay = 17, sink = NullSink())
+    values = blackjack_exact.get_action_values(game, "")
+    self.assertEqual(0, values["Ps"])
+
+  def test_double_down(self):
+    # 11 with only tens left: double down always makes 21 against dealer 20
+    game = Game(deck = [0,0,0,0,0,0,0,0,0,8], p_hand = [4, 5], d_hand = [9], d_stay = 17, sink = NullSink())
+    values = blackjack_exact.get_action_values(game, "")
+    self.assertEqual(2, values["Pd"])
+    self.assertEqual("Pd", reccomend_action(Game(deck = [0,0,0,0,0,0,0,0,0,8], p_hand = [4, 5], d_hand = [9, 9],
+                                                 d_stay = 17, sink = NullSink()), "", engine = "exact"))
+
+class TestBatchRollouts(unittest.TestCase):
+
+  def test_forced_outcomes(self):
+    # only tens left: 12 busts on a hit, dealer 10 + 10 beats a stay on 12
+    state = SearchState(deck = [0,0,0,0,0,0,0,0,0,50], p_total = 12, d_total = 10, d_stay = 17)
+    rng = np.random.default_rng(0)
+    self.assertTrue((blackjack_batch.rollout(state, "Ph", 100, rng = rng) == -1).all())
+    self.assertTrue((blackjack_batch.rollout(state, "Ps", 100, rng = rng) == -1).all())
+
+    # 11 doubled with only tens left makes 21 against dealer 20
+    state = SearchState(deck = [0,0,0,0,0,0,0,0,0,50], p_total = 11, d_total = 10, d_stay = 17)
+    self.assertTrue((blackjack_batch.rollout(state, "Pd", 100, rng = rng) == 2).all())
+
+  def test_matches_metrics(self):
+    results = np.array([-2, -1, 0, 0, 1, 2])
+    metrics = Metrics()
+    for r in results:
+      metrics.update(int(r))
+    self.assertEqual((metrics.wins, metrics.draws, metrics.played), blackjack_batch.get_totals(results))
+
+  def test_run_batch_simulations(self):
+    action_history = {}
+    game = Game(deck = make_n_decks(4), p_hand = [9, 5], d_hand = [9], d_stay = 17, sink = NullSink())
+    run_batch_simulations(game, "", action_history, count = 200, rng = np.random.default_rng(1))
+    self.assertNotIn("Pd", action_history)
+    self.assertEqual(action_history[""].played, action_history["Ph"].played + action_history["Ps"].played)
+    self.assertTrue(action_history["Ph"].played >= 200)
+
+class TestNodeStore(unittest.TestCase):
+
+  def test_find_and_actions(self):
+    store = NodeStore()
+    node = store.find("PhPsDh", create = True)
+    self.assertEqual(4, len(store))
+    self.assertEqual("PhPsDh", store.get_actions(node))
+    self.assertEqual(node, store.find("PhPsDh"))
+    self.assertEqual(-1, store.find("PhPh"))
+    self.assertIn("PhPs", store)
+    self.assertNotIn("Ps", store)
+
+  def test_matches_metrics(self):
+    store = NodeStore()
+    metrics = Metrics()
+    for result in (1, 0, -1, 2, -2, 0):
+      store.update(0, result)
+      metrics.update(result)
+    self.assertEqual(metrics.get_win_percentage(), store.get_win_percentage(0))
+    self.assertEqual((metrics.wins, metrics.draws, metrics.played), (store[""].wins, store[""].draws, store[""].played))
+
+  def test_reroot(self):
+    store = NodeStore()
+    for actions, result in (("PhPs", 1), ("PhPs", 0), ("PhPh", -1), ("Ps", 1)):
+      path = [0]
+      for i in range(0, len(actions), 2):
+        path.append(store.find(actions[:i + 2], create = True))
+      for node in path:
+        store.update(node, result)
+
+    store.reroot("Ph")
+    self.assertEqual("Ph", store.root_actions)
+    self.assertEqual(["Ph", "PhPs"], sorted(store.keys()))
+    self.assertEqual(1.5, store["Ph"].played)
+    self.assertEqual(1, store["PhPs"].played)
+
+  def test_run_simulations(self):
+    game = SearchState(deck = make_n_decks(1), p_total = 10, d_total = 10, d_stay = 17)
+    store = NodeStore()
+    run_simulations(game, "", store, count = 200, progress = False)
+    self.assertEqual(store[""].played, store["Ph"].played + store["Ps"].played + store["Pd"].played)
+    self.assertTrue(store[""].played >= 200)
+
+class TestAnytimeSearch(unittest.TestCase):
+
+  def test_confidence_interval(self):
+    metrics = Metrics()
+    for result in (1, -1) * 50:
+      metrics.update(result)
+    low, high = metrics.get_confidence_interval()
+    self.assertAlmostEqual(0.5 - 1.96 * 0.05, low)
+    self.assertAlmostEqual(0.5 + 1.96 * 0.05, high)
+
+  def test_stops_when_separated(self):
+    # only tens left: hitting 20 always busts, staying always draws with dealer 20
+    game = Game(deck = [0,0,0,0,0,0,0,0,0,50], p_hand = [9, 9], d_hand = [9], d_stay = 17, sink = NullSink())
+    action_history = NodeStore()
+    run = run_anytime_simulations(game, "", action_history, confidence = 0.95, max_count = 5000)
+    self.assertTrue(run < 5000)
+
+  def test_stops_at_limits(self):
+    # hit and stay both always lose, so they never separate
+    game = Game(deck = [0,0,0,0,0,0,0,0,0,50], p_hand = [5, 5], d_hand = [9], d_stay = 17, sink = NullSink())
+    run = run_anytime_simulations(game, "Ph", NodeStore("Ph"), confidence = 0.95, max_count = 200)
+    self.assertEqual(200, run)
+    start = time.perf_counter()
+    run_anytime_simulations(game, "Ph", NodeStore("Ph"), deadline_ms = 50)
+    self.assertTrue(time.perf_counter() - start < 1)
+
+class TestSearchStats(unittest.TestCase):
+
+  def test_run_simulations(self):
+    for tree in (NodeStore(), {}):
+      stats = SearchStats()
+      game = SearchState(deck = make_n_decks(1), p_total = 15, d_total = 10, d_stay = 17)
+      run_simulations(game, "", tree, count = 100, progress = False, stats = stats)
+      self.assertEqual(100, stats.rollouts)
+      self.assertEqual(len(tree) - 1, stats.nodes_created)
+      self.assertTrue(stats.get_average_depth() >= 2)
+      self.assertTrue(stats.timings["select"] > 0 and stats.timings["backup"] > 0)
+
+  def test_reccomend_action_emits(self):
+    sink = CounterSink()
+    game = Game(deck = make_n_decks(1), p_hand = [9, 5], d_hand = [9, 9], d_stay = 17, sink = sink)
+    stats = SearchStats()
+    reccomend_action(game, "", count = 100, stats = stats)
+    self.assertEqual(1, sink.counts["search_stats"])
+    self.assertEqual(100, stats.rollouts)
+    self.assertEqual(stats.tree_bytes, get_tree_memory(NodeStore()) * stats.tree_nodes)
+
+class TestTranspositionTable(unittest.TestCase):
+
+  def test_shared_key(self):
+    # 10 5 and 7 8 against the same upcard and deck are the same position
+    deck = Shoe(make_n_decks(1))
+    a = SearchState(deck = deck, p_total = 15, p_aces = 0, d_total = 10, d_stay = 17)
+    b = SearchState(deck = deck.copy(), p_total = 15, p_aces = 0, d_total = 10, d_stay = 17)
+    soft = SearchState(deck = deck.copy(), p_total = 5, p_aces = 1, d_total = 10, d_stay = 17)
+    self.assertEqual(TranspositionTable.get_key(a, True), TranspositionTable.get_key(b, True))
+    self.assertNotEqual(TranspositionTable.get_key(a, True), TranspositionTable.get_key(soft, True))
+
+  def test_hole_card_hidden(self):
+    # 16 against a 10: the branches of run_hole_search differ only in the facedown card
+    keys = set()
+    for hole in range(10):
+      state = SearchState(deck = make_n_decks(1), p_total = 16, d_total = 10 + hole + 1, d_stay = 17, d_up = 10)
+      state.deck[hole] -= 1
+      keys.add(TranspositionTable.get_key(state, True))
+    self.assertEqual(1, len(keys))
+
+    table = TranspositionTable()
+    game = Game(deck = make_n_decks(1), p_hand = [9, 5], d_hand = [9], d_stay = 17, sink = NullSink())
+    run_hole_search(game, "", NodeStore(), 200, table = table)
+    self.assertEqual(1, len([key for key in table.visits if key[0] == 16 and key[3]]))
+
+  def test_update_matches_metrics(self):
+    table = TranspositionTable()
+    metrics = Metrics()
+    for result in (1, -1, 0, 2):
+      table.update("key", PLAYER_HIT, result)
+      metrics.update(result)
+    parent = Metrics()
+    parent.played = metrics.played
+    self.assertEqual(metrics.get_upper_confidence_bound(parent), table.get_upper_confidence_bound("key", PLAYER_HIT))
+    self.assertEqual(6, table.get_upper_confidence_bound("key", PLAYER_STAY))
+
+  def test_run_simulations(self):
+    for tree in (NodeStore(), {}):
+      table = TranspositionTable()
+      game = SearchState(deck = make_n_decks(1), p_total = 6, d_total = 10, d_stay = 17)
+      run_simulations(game, "", tree, count = 200, progress = False, table = table)
+      root = table.get_key(game, True)
+      self.assertEqual(tree[""].played, table.visits[root])
+      # hitting from 6 reaches many hands, which share entries with each other
+      self.assertTrue(len(table) > 2)
+
+class TestExactDealer(unittest.TestCase):
+
+  def test_distribution(self):
+    # dealer 10 with only 7s and 6s left: 17 or, drawing a 6 to 16, then 22 or 23
+    deck = (0, 0, 0, 0, 0, 2, 2, 0, 0, 0)
+    probs = blackjack_exact.dealer_distribution(deck, 10, False, 16, 17, False, None)
+    self.assertAlmostEqual(1.0, sum(probs))
+    self.assertAlmostEqual(0.5, probs[17])
+    self.assertAlmostEqual(0.5, probs[blackjack_exact.BUST])
+    # the dealer already beats a player on 9, so they stay
+    self.assertEqual(1.0, blackjack_exact.dealer_distribution(deck, 10, False, 9, 17, False, None)[10])
+
+  def test_matches_dealer_ev(self):
+    deck = tuple(make_n_decks(1))
+    for p_score in (12, 16, 18, 20):
+      probs = blackjack_exact.dealer_distribution(deck, 6, False, blackjack_exact.get_distribution_score(p_score, 17),
+                                                  17, False, None)
+      self.assertAlmostEqual(blackjack_exact.dealer_ev(deck, 6, False, p_score, 17, False, None),
+                             blackjack_exact.distribution_ev(probs, p_score))
+
+  def test_settle_dealer(self):
+    state = SearchState(deck = [0, 0, 0, 0, 0, 0, 4, 0, 0, 0], p_total = 18, d_total = 10, d_stay = 17, turn = "Dealer")
+    settle_dealer(state)
+    self.assertEqual("End", state.turn)
+    self.assertEqual(17, state.score_d_hand())
+    self.assertEqual(1, get_score(state, ""))
+
+  def test_expected_counts(self):
+    # dealer 10 with only 7s and 6s left against 16: the dealer makes 17 or busts, half and half
+    state = SearchState(deck = (0, 0, 0, 0, 0, 2, 2, 0, 0, 0), p_total = 16, d_total = 10, d_stay = 17,
+                        turn = "Dealer")
+    self.assertEqual((0.5, 0.0, 1.0, 0.0), get_expected_counts(state))
+    state.doubled = True
+    self.assertEqual((1.0, 0.0, 2.0, 0.0), get_expected_counts(state))
+
+  def test_stand_is_expected(self):
+    # every stand backs up the same expected result, so its win percentage is exact
+    for tree in (NodeStore(), {}):
+      game = SearchState(deck = make_n_decks(1), p_total = 18, d_total = 10, d_stay = 17, d_up = 10)
+      run_simulations(game, "", tree, count = 50, progress = False, exact_dealer = True, allowed = ("Ps",))
+      wins, draws, played, ev = get_expected_counts(make_move(game.clone(), "Ps"))
+      self.assertAlmostEqual((ev + 1) / 2, tree["Ps"].get_win_percentage())
+      self.assertAlmostEqual(50, tree["Ps"].played)
+
+  def test_run_simulations(self):
+    for tree in (NodeStore(), {}):
+      game = SearchState(deck = make_n_decks(1), p_total = 6, d_total = 10, d_stay = 17)
+      run_simulations(game, "", tree, count = 200, progress = False, exact_dealer = True)
+      self.assertEqual(tree[""].played, tree["Ph"].played + tree["Ps"].played)
+      self.assertFalse("PsDh" in tree or "PsDs" in tree)
+
+class TestHoleCard(unittest.TestCase):
+
+  def test_hole_counts(self):
+    game = Game(deck = [4, 0, 0, 0, 0, 0, 0, 0, 2, 6], p_hand = [9, 5], d_hand = [9], sink = NullSink())
+    for count in (1, 7, 100):
+      counts = get_hole_counts(game, count)
+      self.assertEqual(count, sum(counts))
+      # a 10 showing can't be hiding an ace
+      self.assertEqual(0, counts[0])
+    counts = get_hole_counts(game, 100)
+    self.assertEqual([25, 75], [counts[8], counts[9]])
+
+  def test_run_hole_search(self):
+    game = Game(deck = make_n_decks(1), p_hand = [9, 5], d_hand = [9], d_stay = 17, sink = NullSink())
+    for engine in ("mcts", "batch"):
+      tree = {}
+      run_hole_search(game, "", tree, 300, engine)
+      self.assertEqual(300 if engine == "mcts" else 600, tree[""].played)
+      self.assertTrue(tree["Ps"].played > 0)
+
+  def test_unbiased(self):
+    # UCB plays standing on 16 against a ten more often while it's winning, which
+    # must not give it a bigger share of the facedown cards that bust the dealer
+    default_stream.seed(1)
+    game = Game(deck = make_n_decks(1), p_hand = [9, 5], d_hand = [9], d_stay = 17, sink = NullSink())
+    reference = NodeStore()
+    run_hole_search(game, "", reference, 16000, allowed = ["Ps"])
+    rates = []
+    for i in range(8):
+      tree = NodeStore()
+      run_hole_search(game, "", tree, 2000)
+      rates.append(tree["Ps"].get_win_percentage())
+    self.assertAlmostEqual(reference["Ps"].get_win_percentage(), np.mean(rates), delta = 0.008)
+
+class TestPairedComparison(unittest.TestCase):
+
+  def test_shared_sequences(self):
+    # 20 against a dealer 10: standing wins on every order where the dealer
+    # doesn't make 21, and hitting busts on anything but an ace
+    state = SearchState(deck = make_n_decks(1), p_total = 20, d_total = 10, d_stay = 17)
+    results = blackjack_batch.compare_actions(state, ["Ph", "Ps"], 500, rng = np.random.default_rng(1), hole = True)
+    self.assertEqual(len(results["Ph"]), len(results["Ps"]))
+    self.assertTrue(len(results["Ps"]) < 500)
+    # a hit that draws an ace makes 21, which can't do worse than standing on 20
+    self.assertTrue(np.all((results["Ph"] == -1) | (results["Ph"] >= results["Ps"])))
+
+  def test_reccomend_action(self):
+    class RecordingSink(NullSink):
+      def emit(self, event, game = None, **info):
+        self.last = info
+
+    sink = RecordingSink()
+    game = Game(deck = make_n_decks(4), p_hand = [9, 9], d_hand = [5, 9], d_stay = 17, sink = sink)
+    self.assertEqual("Ps", reccomend_action(game, "", engine = "paired", count = 2000))
+    self.assertTrue(sink.last["advantage"] > 0)
+    self.assertTrue(0 < sink.last["error"] < sink.last["advantage"])
+
+class TestRecommendationCache(unittest.TestCase):
+
+  def test_lru(self):
+    cache = RecommendationCache(maxsize = 2)
+    cache.put("a", "Ph")
+    cache.put("b", "Ps")
+    self.assertEqual("Ph", cache.get("a"))
+    cache.put("c", "Ps")
+    # b was the least recently used
+    self.assertIsNone(cache.get("b"))
+    self.assertEqual((1, 1, 2), (cache.hits, cache.misses, len(cache)))
+
+  def test_recommend_many(self):
+    deck = make_n_decks(1)
+    hands = [[9, 4], [4, 9], [6, 7], [9, 4], [9, 9]]
+    states = [(Game(deck = deck.copy(), p_hand = hand, d_hand = [5, 9], d_stay = 17, sink = NullSink()), "")
+              for hand in hands]
+    cache = RecommendationCache()
+    self.assertEqual(["Ph"] * 4 + ["Ps"], recommend_many(states, cache, engine = "exact"))
+    # 10 5, 5 10 and 7 8 are one query, 10 10 another
+    self.assertEqual((3, 2, 2), (cache.hits, cache.misses, len(cache)))
+    recommend_many(states[:1], cache, engine = "exact")
+    self.assertEqual(4, cache.hits)
+    recommend_many(states[:1], cache, engine = "exact", count = 10)
+    self.assertEqual(3, cache.misses)
+
+  def test_batch_larger_than_cache(self):
+    deck = make_n_decks(1)
+    hands = [[9, 4], [9, 9], [4, 5], [9, 4]]
+    states = [(Game(deck = deck.copy(), p_hand = hand, d_hand = [5, 9], d_stay = 17, sink = NullSink()), "")
+              for hand in hands]
+    cache = RecommendationCache(maxsize = 2)
+    self.assertEqual(["Ph", "Ps", "Pd", "Ph"], recommend_many(states, cache, engine = "exact"))
+    self.assertEqual((1, 3, 2), (cache.hits, cache.misses, len(cache)))
+
+class TestTreeEviction(unittest.TestCase):
+
+  def test_prune(self):
+    game = SearchState(deck = make_n_decks(1), p_total = 6, d_total = 10, d_stay = 17)
+    for tree in (NodeStore(), {}):
+      run_simulations(game, "", tree, count = 500, progress = False)
+      root = tree[""]
+      deep = max((a for a in tree.keys() if a.startswith("PhPh")), key = len)
+      prune_tree(tree, 10, deep)
+      self.assertTrue(len(tree) <= 10 + len(deep) // 2)
+      self.assertEqual((root.wins, root.draws, root.played), (tree[""].wins, tree[""].draws, tree[""].played))
+      # the kept path and every kept node's parent are still there
+      self.assertTrue(deep in tree)
+      for a in tree.keys():
+        self.assertTrue(a == "" or a[:-2] in tree)
+
+  def test_run_simulations(self):
+    game = SearchState(deck = make_n_decks(1), p_total = 6, d_total = 10, d_stay = 17)
+    for tree in (NodeStore(), {}):
+      stats = SearchStats()
+      run_simulations(game, "", tree, count = 1000, progress = False, stats = stats, max_nodes = 16)
+      self.assertTrue(len(tree) <= 16)
+      self.assertTrue(stats.nodes_evicted > 0)
+      self.assertEqual(len(tree) - 1, stats.nodes_created - stats.nodes_evicted)
+      self.assertEqual(1000, tree[""].played)
+
+  def test_reccomend_action(self):
+    game = Game(deck = make_n_decks(1), p_hand = [2, 1], d_hand = [9, 9], d_stay = 17, sink = NullSink())
+    stats = SearchStats()
+    max_bytes = 12 * get_node_bytes(NodeStore())
+    reccomend_action(game, "", count = 1000, stats = stats, max_bytes = max_bytes)
+    self.assertTrue(stats.tree_bytes <= max_bytes)
+    self.assertTrue(stats.nodes_evicted > 0)
+
+class TestSpeculativeSearch(unittest.TestCase):
+
+  def test_warms_tree(self):
+    game = Game(deck = make_n_decks(1), p_hand = [9, 4], d_hand = [9, 9], d_stay = 17, sink = NullSink())
+    tree = NodeStore()
+    speculation = SpeculativeSearch(chunk = 20, max_count = 200)
+    speculation.start(game, "", tree)
+    speculation.thread.join()
+    self.assertEqual(200, speculation.stop())
+    self.assertEqual(200, tree[""].played)
+    # a reccomendation afterwards only tops the tree up
+    reccomend_action(game, "", action_history = tree, count = 300)
+    self.assertEqual(300, tree[""].played)
+
+  def test_hit(self):
+    # hard 12 against a ten: after drawing an ace, hitting 13 is right
+    default_stream.seed(5)
+    game = Game(deck = make_n_decks(1), p_hand = [9, 1], d_hand = [9, 6], d_stay = 17, sink = NullSink())
+    game.deck[9] -= 2
+    game.deck[1] -= 1
+    game.deck[6] -= 1
+    speculation = SpeculativeSearch(max_count = 10000)
+    speculation.start_hit(game, "")
+    speculation.thread.join()
+    speculation.stop()
+    # every card drawn got its own tree, rooted after the hit
+    self.assertTrue(len(speculation.trees) > 1)
+    self.assertTrue(all(tree.root_actions == "Ph" for tree in speculation.trees.values()))
+
+    game.p_hand.append(0)
+    game.deck[0] -= 1
+    tree = speculation.trees[get_state_key(game, "Ph")]
+    self.assertTrue(tree["Ph"].played < 10000)
+    self.assertEqual(reccomend_action(game, "Ph", engine = "exact"),
+                     reccomend_action(game, "Ph", action_history = tree))
+
+  def test_play(self):
+    # a player who takes a moment over every choice and always stays
+    class SlowSink(NullSink):
+      def ask_bet(self, game):
+        time.sleep(0.02)
+        return 1.0
+
+      def ask_action(self, game, can_double_down):
+        time.sleep(0.02)
+        return 2
+
+    game = Game(deck = make_n_decks(4), budget = 10.0, d_stay = 17, sink = SlowSink())
+    for i in range(5):
+      play(game, reccs = True, auto = False)
+    self.assertTrue(game.winnings >= -5.0)
+
+  def test_reproducible(self):
+    # a player who takes their time and always stays, the cards they're dealt
+    # must not depend on how long the speculation ran
+    class SlowSink(NullSink):
+      def __init__(self):
+        self.hands = []
+
+      def emit(self, event, game = None, **info):
+        if event == "result":
+          self.hands.append((list(game.p_hand), list(game.d_hand)))
+
+      def ask_action(self, game, can_double_down):
+        time.sleep(0.01)
+        return 2
+
+    hands = []
+    for speculate in (True, False):
+      default_stream.seed(4)
+      game = Game(deck = make_n_decks(2), budget = 10.0, d_stay = 17, sink = SlowSink())
+      for i in range(4):
+        play(game, bet = 1.0, speculate = speculate)
+      hands.append(game.sink.hands)
+    self.assertEqual(hands[0], hands[1])
+
+  def test_deals(self):
+    game = Game(deck = make_n_decks(1), d_stay = 17, sink = NullSink())
+    speculation = SpeculativeSearch(chunk = 20, max_count = 2000)
+    speculation.start_deals(game)
+    speculation.thread.join()
+    self.assertEqual(2000, speculation.stop())
+    # hole card stratification can round each chunk up
+    self.assertTrue(sum(tree[""].played for tree in speculation.trees.values()) >= 2000)
+    self.assertTrue(len(speculation.trees) > 1)
+    self.assertEqual(make_n_decks(1), list(game.deck))
+
+  def test_mode_one(self):
+    # mode 1 chooses the bet before play() and then asks for each action
+    class StaySink(NullSink):
+      def ask_action(self, game, can_double_down):
+        return 2
+
+    # only tens, so every hand opens 20 against a 10
+    game = Game(deck = [0, 0, 0, 0, 0, 0, 0, 0, 0, 40], budget = 10.0, d_stay = 17, sink = StaySink())
+    speculation = SpeculativeSearch(chunk = 50)
+    for i in range(3):
+      speculation.start_deals(game)
+      while speculation.count < 200:
+        time.sleep(0.001)
+      speculation.stop()
+      (tree,) = speculation.trees.values()
+      played = tree[""].played
+      play(game, bet = 1.0, reccs = True, auto = False, trees = speculation.trees)
+      # the reccomendation topped up the speculated tree
+      self.assertTrue(tree[""].played >= max(1000, played + 100))
+    self.assertEqual(0.0, game.winnings)
+
+class TestRolloutPolicy(unittest.TestCase):
+
+  def test_policies(self):
+    # hard 16 against a 10 hits, against a 6 stays, soft 18 against a 9 hits
+    state = SearchState(deck = make_n_decks(1), p_total = 16, d_total = 10, d_stay = 17, d_up = 10)
+    self.assertEqual(PLAYER_HIT, table_rollout(state))
+    state.d_up = 6
+    self.assertEqual(PLAYER_STAY, table_rollout(state))
+    state = SearchState(deck = make_n_decks(1), p_total = 8, p_aces = 1, d_total = 9, d_stay = 17, d_up = 9)
+    self.assertEqual(PLAYER_HIT, table_rollout(state))
+    self.assertEqual(PLAYER_STAY, threshold_rollout(state))
+    self.assertRaises(ValueError, get_rollout_policy, "aggressive")
+
+  def test_play_out(self):
+    for i in range(20):
+      state = SearchState(deck = make_n_decks(1), p_total = 12, d_total = 10, d_stay = 17, d_up = 10)
+      self.assertIn(play_out(state, threshold_rollout), (-1, 0, 1))
+      self.assertEqual("End", state.turn)
+
+  def test_run_simulations(self):
+    for tree in (NodeStore(), {}):
+      game = SearchState(deck = make_n_decks(1), p_total = 6, d_total = 10, d_stay = 17, d_up = 10)
+      run_simulations(game, "", tree, count = 200, progress = False, rollout_policy = "table")
+      self.assertEqual(200, tree[""].played)
+      # every rollout grows the tree by at most one node
+      self.assertTrue(len(tree) <= 201)
+      self.assertEqual(tree[""].played, sum(tree[a].played for a in ("Ph", "Ps", "Pd") if a in tree))
+
+class TestNodePrior(unittest.TestCase):
+
+  def test_approximate_values(self):
+    values = blackjack_exact.approximate_action_values(tuple(make_n_decks(4)), 17)
+    hit, stay, double = values[(20, False, 10)]
+    self.assertTrue(stay > hit)
+    self.assertIsNone(double)
+    hit, stay, double = values[(11, False, 6)]
+    self.assertTrue(hit > stay)
+    self.assertIsNotNone(double)
+    # every result is between losing and winning a doubled bet
+    self.assertTrue(all(-2 <= v <= 2 for entry in values.values() for v in entry if v is not None))
+
+  def test_get_counts(self):
+    prior = NodePrior({(20, False, 10): (-0.8, 0.6, None)}, weight = 10)
+    state = SearchState(deck = make_n_decks(1), p_total = 20, d_total = 10, d_stay = 17, d_up = 10)
+    self.assertEqual((8.0, 10), prior.get_counts(state, PLAYER_STAY))
+    self.assertAlmostEqual(1.0, prior.get_counts(state, PLAYER_HIT)[0])
+    self.assertIsNone(prior.get_counts(state, PLAYER_DOUBLE))
+    self.assertRaises(ValueError, get_prior, "exact", state)
+
+  def test_run_simulations(self):
+    for tree in (NodeStore(), {}):
+      game = SearchState(deck = make_n_decks(1), p_total = 20, d_total = 10, d_stay = 17, d_up = 10)
+      run_simulations(game, "", tree, count = 50, progress = False, prior = "approximate")
+      # the children carry their virtual simulations on top of the real ones
+      self.assertEqual(50, tree[""].played)
+      self.assertEqual(70, tree["Ph"].played + tree["Ps"].played)
+      self.assertTrue(tree["Ps"].get_win_percentage() > tree["Ph"].get_win_percentage())
+
+  def test_reccomend_action(self):
+    # one table per decision, from the deck with the facedown card put back
+    blackjack_exact.clear_cache()
+    game = Game(deck = make_n_decks(1), p_hand = [9, 5], d_hand = [9, 6], d_stay = 17, sink = NullSink())
+    reccomend_action(game, "", count = 300, prior = "approximate")
+    self.assertEqual(1, blackjack_exact.approximate_action_values.cache_info().misses)
+    blackjack_exact.approximate_action_values(tuple(hide_hole_card(game).deck), 17)
+    self.assertEqual(1, blackjack_exact.approximate_action_values.cache_info().misses)
+
+  def test_rollout_policy(self):
+    tree = NodeStore()
+    game = SearchState(deck = make_n_decks(1), p_total = 6, d_total = 10, d_stay = 17, d_up = 10)
+    run_simulations(game, "", tree, count = 1, progress = False, rollout_policy = "table", prior = "approximate")
+    # seeded nodes still count as the frontier, so the policy takes over right below the root
+    self.assertEqual(["", "Ph", "Ps"], sorted(tree.keys()))
+
+class TestRacing(unittest.TestCase):
+
+  def test_allowed(self):
+    for tree in (NodeStore(), {}):
+      game = SearchState(deck = make_n_decks(1), p_total = 10, d_total = 10, d_stay = 17, d_up = 10)
+      run_simulations(game, "", tree, count = 50, progress = False, allowed = ("Ps",))
+      self.assertEqual(50, tree["Ps"].played)
+      self.assertFalse("Ph" in tree and tree["Ph"].played > 0)
+
+  def test_get_contenders(self):
+    tree = {"Ph": Metrics(), "Ps": Metrics(), "Pd": Metrics()}
+    tree["Ph"].played, tree["Ph"].wins = 100, 20
+    tree["Ps"].played, tree["Ps"].wins = 100, 80
+    tree["Pd"].played, tree["Pd"].wins = 10, 0
+    # hitting has clearly lost, doubling hasn't been tried enough to tell
+    self.assertEqual(["Ps", "Pd"], get_contenders(tree, ["Ph", "Ps", "Pd"], 1.96))
+
+  def test_run_racing_simulations(self):
+    game = Game(deck = make_n_decks(1), p_hand = [9, 9], d_hand = [9], d_stay = 17, sink = NullSink())
+    tree = NodeStore()
+    contenders, run = run_racing_simulations(game, "", tree, count = 2000)
+    # hitting 20 is dropped long before the budget runs out
+    self.assertEqual(["Ps"], contenders)
+    self.assertTrue(run < 2000)
+    self.assertEqual(run, tree[""].played)
+
+  def test_reccomend_action(self):
+    game = Game(deck = make_n_decks(1), p_hand = [9, 9], d_hand = [9, 6], d_stay = 17, sink = NullSink())
+    self.assertEqual("Ps", reccomend_action(game, "", count = 500, allocation = "racing"))
+    self.assertRaises(ValueError, reccomend_action, game, "", engine = "batch", allocation = "racing")
+    self.assertRaises(ValueError, reccomend_action, game, "", allocation = "halving")
+
+class TestSeededSearch(unittest.TestCase):
+
+  def test_reproducible(self):
+    game = SearchState(deck = make_n_decks(4), p_total = 12, d_total = 10, d_stay = 17, d_up = 10)
+    runs = []
+    for i in range(2):
+      default_stream.seed(11)
+      store = NodeStore()
+      run_simulations(game, "", store, count = 300, progress = False, exact_dealer = True)
+      action_history = {}
+      run_batch_simulations(game, "", action_history, count = 100)
+      runs.append((store.get_totals(), action_history["Ph"].wins, get_hole_counts(Game(deck = make_n_decks(1),
+                   d_hand = [9], sink = NullSink()), 100)))
+    self.assertEqual(runs[0], runs[1])
+
+class TestParallelSimulations(unittest.TestCase):
+
+  def test_merge_metrics(self):
+    action_history = {"": Metrics()}
+    merge_metrics(action_history, {"": (3, 1, 6), "Ph": (2, 0, 4)})
+    merge_metrics(action_history, {"": (1, 1, 2)})
+    self.assertEqual((4, 2, 8), (action_history[""].wins, action_history[""].draws, action_history[""].played))
+    self.assertEqual(4, action_history["Ph"].played)
+
+  def test_run_parallel_simulations(self):
+    game = Game(deck = make_n_decks(1), p_hand = [9, 5], d_hand = [9], d_stay = 17, sink = NullSink())
+    action_history = {}
+    run_parallel_simulations(game, "", action_history, count = 50, workers = 2, seed = 7)
+    self.assertEqual(action_history[""].played, action_history["Ph"].played + action_history["Ps"].played)
+    self.assertTrue(action_history[""].played >= 100)
+
+  def test_search_options(self):
+    game = Game(deck = make_n_decks(1), p_hand = [9, 5], d_hand = [9, 6], d_stay = 17, sink = NullSink())
+    action_history = NodeStore()
+    run_search(hide_hole_card(game), "", action_history, 50, workers = 2, max_nodes = 20, allowed = ["Ps"],
+               prior = "approximate", exact_dealer = True)
+    self.assertTrue(len(action_history) <= 20)
+    self.assertNotIn("Ph", action_history)
+    self.assertRaises(ValueError, reccomend_action, game, "", workers = 2, count = 50, table = TranspositionTable())
+
+  def test_reproducible(self):
+    game = Game(deck = make_n_decks(1), p_hand = [9, 5], d_hand = [9, 6], d_stay = 17, sink = NullSink())
+    runs = []
+    for i in range(2):
+      default_stream.seed(3)
+      action_history = NodeStore()
+      reccomend_action(game, "", workers = 2, action_history = action_history, count = 100)
+      runs.append(action_history.get_totals())
+    self.assertEqual(runs[0], runs[1])
+
+class TestTreeReuse(unittest.TestCase):
+
+  def test_reroot_tree(self):
+    action_history = {"": Metrics(), "Ph": Metrics(), "Ps": Metrics(), "PhPs": Metrics(), "PhPh": Metrics()}
+    action_history["Ph"].update(1)
+    action_history["Ph"].update(0)
+    action_history["PhPs"].update(-1)
+    action_history["PhPs"].update(1)
+    action_history["PhPh"].update(0)
+    reroot_tree(action_history, "Ph")
+    self.assertEqual(["Ph", "PhPs"], sorted(action_history))
+    self.assertEqual(1, action_history["Ph"].played)
+    self.assertEqual(0.5, action_history["Ph"].wins)
+
+  def test_batch_is_not_topped_up(self):
+    # the batch engine leaves no subtree, so a kept tree mustn't cut the next search short
+    game = Game(deck = make_n_decks(4), p_hand = [9, 4], d_hand = [9, 6], d_stay = 17, sink = NullSink())
+    action_history = NodeStore()
+    for i in range(2):
+      reccomend_action(game, "", engine = "batch", action_history = action_history, count = 1000,
+                       stratify_hole = False)
+    # standing never pays double, so every rollout counts once
+    self.assertEqual(2000, action_history["Ps"].played)
+
+  def test_reused_tree_is_topped_up(self):
+    game = Game(deck = make_n_decks(1), p_hand = [9, 5], d_hand = [9, 9], d_stay = 17, sink = NullSink())
+    action_history = {}
+    reccomend_action(game, "", action_history = action_history, count = 200)
+    self.assertEqual(200, action_history[""].played)
+    reccomend_action(game, "", action_history = action_history, count = 300)
+    self.assertEqual(300, action_history[""].played)
+    reccomend_action(game, "", action_history = action_history, count = 300)
+    self.assertEqual(330, action_history[""].played)
+
 # actions tracks all actions that resulted in a given game state
 # "Ph" = player hit
 # "Ps" = player stay
@@ -430,6 +2418,8 @@ mode = 1
 if __name__ == '__main__':
   cutoffScore = -1.5
   aggression = 0.3
+  # built offline with blackjack_strategy.py, searched decisions are used when it is missing
+  strategy_path = "strategy.npy"
 
   # Interactive Demo ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
   if(mode == 1):
@@ -444,7 +2434,20 @@ if __name__ == '__main__':
 
     game = Game(d_stay = 17, deck = make_n_decks(numdecks), budget = budget)
 
+    # answer recurring decisions from the strategy table, searching only on a miss
+    policy = None
+    if os.path.exists(strategy_path):
+      import blackjack_strategy
+      policy = blackjack_strategy.StrategyTable(strategy_path, numdecks).get_policy()
+
+    # search the upcoming hand while the player reads the count and chooses a bet
+    speculation = None
+    if policy is None:
+      speculation = SpeculativeSearch()
+
     while(True):
+      if speculation is not None:
+        speculation.start_deals(game)
       deck_score = evaluate_deck(game.deck, numdecks)
       if deck_score <= cutoffScore:
         print("\nTrue Count is {}. Reccomend you stop playing".format(deck_score))
@@ -455,7 +2458,7 @@ if __name__ == '__main__':
       if cont != 'y' and cont != 'Y' and cont != '':
         break;
       
-      reccbet = max(min(minBet, game.budget + game.winnings), min(maxBet, minBet + ((deck_score - cutoffScore) / 2.0)))
+      reccbet = reccomend_bet(deck_score, minBet, maxBet, game.budget + game.winnings, cutoffScore)
       print("You have ${0:.2f} in funds.".format(game.budget + game.winnings))
       print("Enter bet amount (reccomend ${0:.2f})".format(reccbet))
       bet = input()
@@ -464,42 +2467,39 @@ if __name__ == '__main__':
       else:
         bet = float(bet)
 
-      play(game, bet = bet, reccs = True, auto = False)
+      trees = None
+      if speculation is not None:
+        speculation.stop()
+        trees = speculation.trees
+      play(game, bet = bet, reccs = True, auto = False, policy = policy, trees = trees)
 
       if sum(game.deck) < 52.0 * numdecks / 4.0:
         print("Shuffling Decks...")
         game.deck = make_n_decks(numdecks)
 
+    if speculation is not None:
+      speculation.stop()
     print("\nALL GAMES PLAYED!\nEnding Funds: ${0:.2f}".format(game.budget + game.winnings))
 
 
   # simulation demo ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
   if mode == 2:
-    numGames = 5
-    numHands = 15
+    import blackjack_sim
+
+    numShoes = 5
     maxBet = 3.0
     minBet = 1.0
     numdecks = 4
 
+    stats = blackjack_sim.simulate(numShoes, numdecks = numdecks, minBet = minBet, maxBet = maxBet,
+                                   budget = 30.00, cutoffScore = cutoffScore, policy = "mcts",
+                                   workers = os.cpu_count(), aggression = aggression)
+
     csvfile = open("results.csv", "w", newline='')
     csvwriter = csv.writer(csvfile, delimiter=',', dialect='excel', quotechar='|', quoting=csv.QUOTE_MINIMAL)
     csvwriter.writerow(['aggression', 'winnings'])
+    for winnings in stats["shoe_winnings"]:
+      csvwriter.writerow([aggression, winnings])
+    csvfile.close()
 
-    for j in range(0,numGames):
-      game = Game(d_stay = 17, deck = make_n_decks(numdecks), budget = 30.00)
-      for i in range(0, numHands):
-        deck_score = evaluate_deck(game.deck, numdecks)
-        if deck_score <= cutoffScore:
-          print("Walking away")
-          break
-        bet = max(min(minBet, game.budget + game.winnings), min(maxBet, minBet + ((deck_score - cutoffScore) / 2.0)))
-        if(game.budget + game.winnings - bet < 0):
-          print("Out of cash")
-          break
-        play(game, bet = bet, reccs = True, auto = True)
-        if sum(game.deck) < 52.0 * numdecks / 4.0:
-          print("Shuffling...")
-          game.deck = make_n_decks(numdecks)
-
-      csvwriter.writerow([aggression, game.winnings])
-      print("\nALL GAMES PLAYED!\nEnding Funds: ${0:.2f}".format(game.budget + game.winnings))
+    print(blackjack_sim.format_stats(stats))
@@ -0,0 +1,125 @@
+# Headless shoe simulator
+#
+# Plays complete shoes with true-count betting into a NullSink, spread
+# over a pool of worker processes, and reports aggregate bankroll statistics.
+# Each shoe starts a fresh bankroll of budget and is played until the deck
+# needs reshuffling, the true count drops to cutoffScore (walk away) or the
+# bankroll can't cover the next bet.
+
+from blackjack import Game, NullSink, default_stream
+from blackjack_mcts import play, evaluate_deck, reccomend_bet, make_n_decks, basic_strategy
+import blackjack_mcts
+from concurrent.futures import ProcessPoolExecutor
+import time
+import unittest
+import numpy as np
+
+# Fixed strategy table (basic_strategy), a quick stand-in for search when
+# evaluating betting.
+def table_policy(game, actions):
+  return basic_strategy(game.score_p_hand(), game.p_hand.is_soft, game.d_hand[0] + 1, actions == "")
+
+# play one shoe, returning the result of every hand played and why it ended
+def play_shoe(numdecks, minBet, maxBet, budget, cutoffScore, policy, d_stay):
+  game = Game(d_stay = d_stay, deck = make_n_decks(numdecks), budget = budget, sink = NullSink())
+  results = []
+  wagered = 0.0
+  reason = "shuffle"
+
+  while sum(game.deck) >= 52.0 * numdecks / 4.0:
+    deck_score = evaluate_deck(game.deck, numdecks)
+    if deck_score <= cutoffScore:
+      reason = "walked away"
+      break
+    funds = game.budget + game.winnings
+    bet = reccomend_bet(deck_score, minBet, maxBet, funds, cutoffScore)
+    if funds - bet < 0 or bet <= 0:
+      reason = "out of cash"
+      break
+
+    before = game.winnings
+    if policy == "table":
+      play(game, bet = bet, reccs = True, auto = True, policy = table_policy)
+    else:
+      play(game, bet = bet, reccs = True, auto = True, engine = policy)
+    results.append(game.winnings - before)
+    wagered += bet
+
+  return results, wagered, reason
+
+# Worker body: play count shoes with its own random stream and return totals
+def run_shoes(count, numdecks, minBet, maxBet, budget, cutoffScore, policy, d_stay, seed, aggression):
+  default_stream.seed(int(seed))
+  if aggression is not None:
+    blackjack_mcts.aggression = aggression
+
+  totals = {"shoes": 0, "hands": 0, "wagered": 0.0, "winnings": 0.0, "sum_squares": 0.0,
+            "shoe_winnings": [], "walked away": 0, "out of cash": 0, "shuffle": 0}
+
+  for i in range(count):
+    results, wagered, reason = play_shoe(numdecks, minBet, maxBet, budget, cutoffScore, policy, d_stay)
+    totals["shoes"] += 1
+    totals["hands"] += len(results)
+    totals["wagered"] += wagered
+    totals["winnings"] += sum(results)
+    totals["sum_squares"] += sum(r * r for r in results)
+    totals["shoe_winnings"].append(sum(results))
+    totals[reason] += 1
+  return totals
+
+# Simulate shoes full shoes and return aggregate statistics.
+# policy is "table" (table_policy) or a reccomend_action engine ("mcts", "batch", "exact").
+# workers sets the number of processes, seed makes the run reproducible.
+def simulate(shoes, numdecks = 4, minBet = 1.0, maxBet = 3.0, budget = 30.0, cutoffScore = -1.5,
+             policy = "table", d_stay = 17, workers = 1, seed = None, aggression = None):
+  start = time.perf_counter()
+  workers = max(1, min(workers or 1, shoes))
+  seeds = [s.generate_state(1)[0] for s in np.random.SeedSequence(seed).spawn(workers)]
+  counts = [shoes // workers + (1 if i < shoes % workers else 0) for i in range(workers)]
+  args = (numdecks, minBet, maxBet, budget, cutoffScore, policy, d_stay)
+
+  if workers == 1:
+    results = [run_shoes(counts[0], *args, seeds[0], aggression)]
+  else:
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+      futures = [pool.submit(run_shoes, counts[i], *args, seeds[i], aggression) for i in range(workers)]
+      results = [f.result() for f in futures]
+
+  stats = results[0]
+  for totals in results[1:]:
+    for key, value in totals.items():
+      stats[key] += value
+
+  seconds = time.perf_counter() - start
+  hands = stats["hands"]
+  stats["seconds"] = seconds
+  stats["hands_per_second"] = hands / seconds if seconds > 0 else 0.0
+  stats["mean"] = stats["winnings"] / hands if hands > 0 else 0.0
+  stats["stdev"] = max(0.0, stats["sum_squares"] / hands - stats["mean"] ** 2) ** .5 if hands > 0 else 0.0
+  stats["return"] = stats["winnings"] / stats["wagered"] if stats["wagered"] > 0 else 0.0
+  return stats
+
+def format_stats(stats):
+  return ("Shoes: {shoes}  Hands: {hands}  ({hands_per_second:.0f} hands/s over {seconds:.1f}s)\n"
+          "Wagered: ${wagered:.2f}  Winnings: ${winnings:.2f}  Return: {return:+.2%}\n"
+          "Per hand: mean ${mean:+.4f}  stdev ${stdev:.4f}\n"
+          "Shoes ended by shuffle: {shuffle}  walked away: {walked away}  out of cash: {out of cash}").format(**stats)
+
+class TestSimulator(unittest.TestCase):
+
+  def test_table_policy(self):
+    self.assertEqual("Pd", table_policy(Game(p_hand = [4, 5], d_hand = [5, 9], sink = NullSink()), ""))
+    self.assertEqual("Ph", table_policy(Game(p_hand = [4, 5], d_hand = [5, 9], sink = NullSink()), "Ph"))
+    self.assertEqual("Ps", table_policy(Game(p_hand = [9, 3], d_hand = [5, 9], sink = NullSink()), ""))
+    self.assertEqual("Ph", table_policy(Game(p_hand = [9, 3], d_hand = [9, 9], sink = NullSink()), ""))
+    self.assertEqual("Ph", table_policy(Game(p_hand = [0, 5], d_hand = [9, 9], sink = NullSink()), ""))
+    self.assertEqual("Ps", table_policy(Game(p_hand = [0, 7], d_hand = [5, 9], sink = NullSink()), ""))
+
+  def test_simulate(self):
+    stats = simulate(5, seed = 3)
+    self.assertEqual(5, stats["shoes"])
+    self.assertEqual(5, stats["shuffle"] + stats["walked away"] + stats["out of cash"])
+    self.assertEqual(len(stats["shoe_winnings"]), 5)
+    self.assertAlmostEqual(stats["winnings"], sum(stats["shoe_winnings"]))
+    again = simulate(5, seed = 3)
+    self.assertEqual((stats["hands"], stats["winnings"]), (again["hands"], again["winnings"]))
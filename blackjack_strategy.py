@@ -0,0 +1,207 @@
+# Precomputed strategy table
+#
+# Most decisions recur constantly (hard 16 vs 10, soft 18 vs 9, 11 vs 6 ...),
+# so instead of searching each one, an offline build solves every
+#   (true count bucket, player score, soft, dealer upcard, double allowed)
+# with the exact engine on a representative deck and hand, and saves the best
+# action and its expected value to a .npy file. At startup the file is memory
+# mapped, a lookup is a handful of integer operations, and only situations
+# outside the table fall back to a search.
+#
+#   python blackjack_strategy.py strategy.npy --decks 4
+#
+# The true count is evaluate_deck over the decks actually remaining, rounded
+# to a whole number. The shoe size and dealer stay limit the table was solved
+# for are saved next to it (strategy.npy.json), and a table only answers for
+# games that match them.
+
+from blackjack import Game, NullSink
+from blackjack_mcts import reccomend_action, evaluate_deck, make_n_decks, action_to_text, ACTION_CODES
+import blackjack_exact
+import argparse
+import json
+import os
+import tempfile
+import unittest
+import numpy as np
+from tqdm import tqdm
+
+# one entry: index into ACTION_CODES of the best action, and its expected value
+entry_type = np.dtype([("action", "u1"), ("value", "<f4")])
+# action of entries that were never solved
+MISSING = 255
+
+MIN_SCORE = 4
+MAX_SCORE = 21
+UPCARDS = 10
+
+def get_true_count(deck):
+  return evaluate_deck(deck, sum(deck) / 52.0)
+
+# where build_table saves what the table at path was solved for
+def get_info_path(path):
+  return path + ".json"
+
+# the cards of a representative hand for score, as card indexes (value - 1)
+def make_hand(score, soft):
+  cards = []
+  if soft:
+    cards.append(0)
+    score -= 11
+    if score == 1:
+      return cards + [0]
+  # two to ten only, never leaving a remainder of 1 that only an ace could fill
+  while score > 0:
+    card = min(10, score)
+    if score - card == 1:
+      card -= 1
+    cards.append(card - 1)
+    score -= card
+  return cards
+
+# numdecks decks with low or high cards taken out until the true count rounds to bucket
+def make_deck(numdecks, bucket):
+  deck = make_n_decks(numdecks)
+  low = 1
+  while round(get_true_count(deck)) != bucket:
+    if get_true_count(deck) < bucket:
+      # take out a 2-6
+      deck[low] -= 1
+      low = low % 5 + 1
+    else:
+      # take out a ten or an ace
+      deck[9 if deck[9] >= 4 * deck[0] else 0] -= 1
+  return deck
+
+# Solve every situation and save the table to path. buckets are the true
+# counts to cover, the range must be centred on 0 (e.g. range(-4, 5)).
+def build_table(path, numdecks = 4, buckets = range(-4, 5), progress = True, d_stay = 17):
+  buckets = list(buckets)
+  if buckets[0] != -buckets[-1] or len(buckets) != 2 * buckets[-1] + 1:
+    raise ValueError('buckets must be a range centred on 0, got {}'.format(buckets))
+
+  shape = (len(buckets), MAX_SCORE - MIN_SCORE + 1, 2, UPCARDS, 2)
+  table = np.lib.format.open_memmap(path, mode = "w+", dtype = entry_type, shape = shape)
+  table["action"] = MISSING
+
+  situations = [(b, s, soft, up) for b in range(len(buckets)) for s in range(MIN_SCORE, MAX_SCORE + 1)
+                for soft in (False, True) for up in range(UPCARDS) if not soft or s >= 12]
+  for b, score, soft, upcard in (tqdm(situations) if progress else situations):
+    deck = make_deck(numdecks, buckets[b])
+    game = Game(deck = deck, p_hand = make_hand(score, soft), d_hand = [upcard], d_stay = d_stay, sink = NullSink())
+    for card in game.p_hand + game.d_hand:
+      game.deck[card] -= 1
+
+    values = blackjack_exact.get_action_values(game, "")
+    for double in (False, True):
+      allowed = {a: v for a, v in values.items() if double or a != "Pd"}
+      action = max(allowed, key = allowed.get)
+      table[b, score - MIN_SCORE, int(soft), upcard, int(double)] = (ACTION_CODES.index(action), allowed[action])
+
+  table.flush()
+  with open(get_info_path(path), "w") as f:
+    json.dump({"numdecks": numdecks, "d_stay": d_stay}, f)
+  return table
+
+# Read-only view of a built table. Keeps hit and miss counts for reporting.
+# numdecks is the size of the shoe being played: a table solved for another
+# size, or saved without its info file, misses every lookup.
+class StrategyTable:
+  def __init__(self, path, numdecks = None):
+    self.entries = np.load(path, mmap_mode = "r")
+    self.max_bucket = self.entries.shape[0] // 2
+    self.info = None
+    if os.path.exists(get_info_path(path)):
+      with open(get_info_path(path)) as f:
+        self.info = json.load(f)
+    self.usable = self.info is not None and (numdecks is None or numdecks == self.info["numdecks"])
+    self.hits = 0
+    self.misses = 0
+
+  # (action code, expected value) for the player's decision, None on a miss
+  def lookup(self, game, actions):
+    if not self.usable or game.d_stay != self.info["d_stay"]:
+      self.misses += 1
+      return None
+
+    # count the deck the player sees, with the dealer's facedown card back in it
+    deck = list(game.deck)
+    if len(game.d_hand) > 1:
+      deck[game.d_hand[-1]] += 1
+    score = game.score_p_hand()
+    bucket = round(get_true_count(deck))
+    if score < MIN_SCORE or score > MAX_SCORE or abs(bucket) > self.max_bucket:
+      self.misses += 1
+      return None
+
+    soft = game.p_hand.is_soft
+    double = actions == "" and score >= 9 and score <= 11
+    entry = self.entries[bucket + self.max_bucket, score - MIN_SCORE, int(soft), game.d_hand[0], int(double)]
+    if entry["action"] == MISSING:
+      self.misses += 1
+      return None
+    self.hits += 1
+    return ACTION_CODES[entry["action"]], float(entry["value"])
+
+  # A play() policy that answers from the table and only searches on a miss.
+  # search holds the keyword arguments for reccomend_action.
+  def get_policy(self, **search):
+    def policy(game, actions):
+      found = self.lookup(game, actions)
+      if found is None:
+        game.sink.emit("searching", game)
+        return reccomend_action(game, actions, **search)
+      action, value = found
+      game.sink.emit("recommendation", game, action = action, value = value,
+                     text = action_to_text(action) + " (strategy table, expected value {:+.3f}x bet)".format(value))
+      return action
+    return policy
+
+class TestStrategyTable(unittest.TestCase):
+
+  def test_make_hand(self):
+    self.assertEqual([9, 5], make_hand(16, False))
+    self.assertEqual([9, 8, 1], make_hand(21, False))
+    self.assertEqual([0, 0], make_hand(12, True))
+    self.assertEqual([0, 6], make_hand(18, True))
+
+  def test_make_deck(self):
+    for bucket in (-2, 0, 3):
+      self.assertEqual(bucket, round(get_true_count(make_deck(4, bucket))))
+
+  def test_build_and_lookup(self):
+    path = os.path.join(tempfile.mkdtemp(), "strategy.npy")
+    build_table(path, numdecks = 1, buckets = range(0, 1), progress = False)
+    table = StrategyTable(path, numdecks = 1)
+
+    # 11 against a 6 doubles when it can, hard 20 stands; the facedown 10 has
+    # left the deck like during play, which alone would make the count -1
+    deck = make_deck(1, 0)
+    deck[9] -= 1
+    self.assertEqual("Ps", table.lookup(Game(deck = deck, p_hand = [9, 9], d_hand = [5, 9], d_stay = 17), "")[0])
+    self.assertEqual("Pd", table.lookup(Game(deck = deck, p_hand = [8, 1], d_hand = [5, 9], d_stay = 17), "")[0])
+    self.assertNotEqual("Pd", table.lookup(Game(deck = deck, p_hand = [8, 1], d_hand = [5, 9], d_stay = 17), "Ph")[0])
+    # a count outside the table is a miss
+    self.assertIsNone(table.lookup(Game(deck = make_deck(1, 3), p_hand = [9, 9], d_hand = [5, 9], d_stay = 17), ""))
+    self.assertEqual((3, 1), (table.hits, table.misses))
+
+  def test_mismatched_game(self):
+    path = os.path.join(tempfile.mkdtemp(), "strategy.npy")
+    build_table(path, numdecks = 1, buckets = range(0, 1), progress = False)
+    deck = make_deck(1, 0)
+    deck[9] -= 1
+    # solved for one deck staying on 17: other shoes and stay limits miss
+    self.assertIsNone(StrategyTable(path, numdecks = 4).lookup(
+      Game(deck = deck, p_hand = [9, 9], d_hand = [5, 9], d_stay = 17), ""))
+    self.assertIsNone(StrategyTable(path).lookup(Game(deck = deck, p_hand = [9, 9], d_hand = [5, 9], d_stay = 21), ""))
+    os.remove(get_info_path(path))
+    self.assertIsNone(StrategyTable(path).lookup(Game(deck = deck, p_hand = [9, 9], d_hand = [5, 9], d_stay = 17), ""))
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description = "Build the precomputed strategy table")
+  parser.add_argument("path", help = "file to write, e.g. strategy.npy")
+  parser.add_argument("--decks", type = int, default = 4, help = "decks in the shoe the table is solved for")
+  parser.add_argument("--max-count", type = int, default = 4, help = "largest true count bucket to cover")
+  parser.add_argument("--stay", type = int, default = 17, help = "dealer stay limit the table is solved for")
+  args = parser.parse_args()
+  build_table(args.path, args.decks, range(-args.max_count, args.max_count + 1), d_stay = args.stay)